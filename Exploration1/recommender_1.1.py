@@ -17,17 +17,30 @@
 #
 
 #   These are standard python modules/packages
-import sys, datetime, json
+import sys, os, time
 #
-#   You may need to install this one - depending on what kind of python you are using
-try:
-    import requests
-except:
+#   You may need to install 'requests' - depending on what kind of python you
+#   are using. It takes a while to import, so the chat client only imports it
+#   when the first request is made, but we check that it is there right away.
+import importlib.util
+if importlib.util.find_spec("requests") is None:
     print("\n\nThis example depends upon the 'requests' module. This exception is because ")
     print("it looks like you have not installed the 'requests' module. You should visit")
     print("     https://pypi.org/project/requests/")
     print("for instructions on installing 'requests'.\n\n")
     sys.exit()
+#
+#   The chat client shared by all of the prototypes lives in the 'common'
+#   folder at the top of this repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.chat_client import get_shared_client, ChatRequestError
+from common.context_window import ContextWindow
+from common.response_cache import ResponseCache
+from common.scheduler import RequestScheduler
+from common.metrics import Instrumentation, MetricsRegistry, JsonLinesSink, new_turn_record
+from common.session_store import SessionStore, new_session_id
+from common.chat_message import ChatMessage, ChatContext
+from common.memory import TieredMemory, chat_summarizer
 
 #   CONSTANTS
 #
@@ -38,6 +51,53 @@ OAI_MODEL = "gpt-4-turbo-preview"
 OAI_MODEL_TEMPERATURE = 0.7
 OAI_MODEL_MAX_TOKENS = 500
 #
+#   Set this to True to print the response as it is generated, instead
+#   of waiting for the whole response to arrive
+OAI_STREAM_RESPONSES = False
+#
+#   The whole chat history is sent with every request. Once the history
+#   (plus the response) grows past this many tokens the oldest turns are
+#   dropped. The system turn is always kept.
+OAI_CONTEXT_TOKEN_BUDGET = 3000
+CONTEXT_WINDOW = ContextWindow(OAI_CONTEXT_TOKEN_BUDGET)
+#
+#   Responses are remembered so the same request is not paid for twice.
+#   Only requests with OAI_MODEL_TEMPERATURE = 0 are cached, because with
+#   a higher temperature the model is expected to answer differently.
+RESPONSE_CACHE = ResponseCache()
+#
+#   Failed requests are retried, and requests are paced to stay within the
+#   rate limits of your key. Set these to the limits of your account.
+OAI_REQUESTS_PER_MINUTE = 500
+OAI_TOKENS_PER_MINUTE = 30000
+REQUEST_SCHEDULER = RequestScheduler(OAI_REQUESTS_PER_MINUTE, OAI_TOKENS_PER_MINUTE)
+#
+#   Every request is measured (see common/metrics.py). The measurements are
+#   kept in METRICS_REGISTRY. Set OAI_METRICS_LOG to also write each turn to
+#   a JSON lines file, and OAI_METRICS_DUMP to write the counters and
+#   histograms in the Prometheus text format when the session ends.
+OAI_METRICS_LOG = None
+OAI_METRICS_DUMP = None
+METRICS_REGISTRY = MetricsRegistry()
+METRICS = Instrumentation([METRICS_REGISTRY])
+if OAI_METRICS_LOG:
+    METRICS.add_sink(JsonLinesSink(OAI_METRICS_LOG))
+#
+#   Every turn is added to a log for the session, so a chat can be picked up
+#   again later with:  python recommender_1.1.py SESSION_ID
+SESSION_STORE = SessionStore()
+#
+#   Long chats keep a tiered memory (see common/memory.py): the latest
+#   OAI_RECENT_TURNS turns word for word, a summary of the older turns, and
+#   the likes and dislikes the user has mentioned. The summary is written by
+#   the cheaper OAI_SUMMARY_MODEL in the background, after each response.
+OAI_RECENT_TURNS = 6
+OAI_SUMMARY_MODEL = "gpt-3.5-turbo"
+MEMORY = TieredMemory(recent_turns=OAI_RECENT_TURNS)
+#   Turns the context window has to drop before they are in the summary are
+#   handed to the memory, so they are still summarized
+MEMORY.attach(CONTEXT_WINDOW)
+#
 #   One should never put their key right in the code like this
 #   A later prototype will show an alternative that solves this problem
 API_KEY = "Your_API_Key"
@@ -54,18 +114,16 @@ MOVIE_RECOMMENDER_PERSONA_PROMPT = '''You are a movie critic who wants to make s
 
 #
 #   Create a new chat turn.
-#   Each chat turn is a dictionary with a 'role' and 'content'
+#   Each chat turn has a 'role' and 'content', and can be used like a
+#   dictionary. It remembers its own JSON, so it is only encoded once.
 def new_chat_turn(role="",content=""):
-    turn = dict()
-    turn['role'] = role
-    turn['content'] = content
-    return turn
+    return ChatMessage(role, content)
 #
 #   The code needs to maintain the status of the chat. This status 
 #   will include parameters that tell the model how it should respond
 #   as well as all of the user questions and the responses.
 def new_chat_context():
-    chat_context = dict()
+    chat_context = ChatContext()
     chat_context['model'] = OAI_MODEL
     chat_context['messages'] = list()
     system_turn = new_chat_turn("system",MOVIE_RECOMMENDER_PERSONA_PROMPT)
@@ -76,8 +134,13 @@ def new_chat_context():
 #
 #   Making a request is about modifying the growing chat_context
 #   setting up the HTTP request URL and request headers, and making
-#   the request.
-def make_chat_request(user_text="", chat_context=None, api_key=""):
+#   the request. If on_token is given the response is streamed, and
+#   on_token is called with each piece of text as it arrives. If a
+#   session_id is given the new turns are saved in the session log.
+def make_chat_request(user_text="", chat_context=None, api_key="", on_token=None, session_id=None):
+    #   Time how long it takes to get the messages ready
+    turn_record = new_turn_record()
+    start = time.perf_counter()
     #   If no chat context is provided, then this is a new chat
     if not chat_context:
         # create and use a new chat context
@@ -87,43 +150,82 @@ def make_chat_request(user_text="", chat_context=None, api_key=""):
     user_turn = new_chat_turn("user",user_text)
     #   Add that user turn to the list of messages in the context
     chat_context['messages'].append(user_turn)
+    #   Drop old turns if the history has grown past the token budget
+    CONTEXT_WINDOW.trim(chat_context)
+    turn_record['prompt_build_s'] = time.perf_counter() - start
     
-    #   The whole context is payload for the request - a request body
-    payload = json.dumps(chat_context)
-    
-    #   Create header information for the request - this must include
-    #   the 'Content-Type' key set to 'application/json' and the
-    #   'Authorization' key set to include your API key
-    header = dict()
-    header['Content-Type'] = "application/json"
-    header['Authorization'] = f"Bearer {api_key}"
-    
-    #   The service URL is the host and the service endpoint
-    service_url = OAI_HOST + OAI_SERVICE_ENDPOINT
-    
-    #   Make this as a POST request
-    response = requests.post(service_url,
-                             headers=header,
-                             data=payload)
-    #   The response should be 'application/json' so extract the JSON
-    resp_dict = response.json()
+    #   The whole context is payload for the request. The shared client
+    #   keeps its connection to the service open between turns and already
+    #   has the request headers with your API key
+    client = get_shared_client(api_key, OAI_HOST, OAI_SERVICE_ENDPOINT,
+                               cache=RESPONSE_CACHE, scheduler=REQUEST_SCHEDULER,
+                               metrics=METRICS)
+    try:
+        if on_token:
+            resp_dict = client.stream_chat(chat_context, on_token, turn_record)
+        else:
+            resp_dict = client.post_chat(chat_context, turn_record)
+    except ChatRequestError:
+        #   Take the user turn back out so the chat can carry on
+        chat_context['messages'].pop()
+        raise
     #   print("DEBUG Response:", json.dumps(resp_dict, indent=2))  # 添加这行打印内容
     #   There is a lot in the response - just extract the message
     assistant_turn = resp_dict['choices'][0]['message']
     #   Add the response to our chat context
     chat_context['messages'].append(assistant_turn)
+    #   Only the two new turns are written, never the whole history
+    if session_id:
+        SESSION_STORE.extend(session_id, (user_turn, assistant_turn))
     usage = resp_dict.get("usage", {}).get("total_tokens", 0)
     return chat_context, usage
 
+#
+#   Print a piece of a streamed response without starting a new line
+def print_token(text):
+    print(text, end="", flush=True)
+
+#
+#   Batch mode answers a whole file of questions without the chat loop:
+#       python recommender_1.1.py --batch questions.jsonl answers.jsonl
+#   Every question starts from a copy of the same new chat context, so
+#   the system turn is only built (and encoded) once.
+def run_batch(argv):
+    from common import batch
+    base_context = new_chat_context()
+    def answer(user_text):
+        chat_context, usage = make_chat_request(user_text, base_context.copy(), API_KEY)
+        return chat_context['messages'][-1]['content']
+    batch.main(argv, answer, METRICS, prog=f"{sys.argv[0]} --batch")
+    if OAI_METRICS_DUMP:
+        METRICS_REGISTRY.dump_prometheus(OAI_METRICS_DUMP)
+
 #
 #   The main is called from the command line and just loops asking
 #   for user to input
 def main():
+    if sys.argv[1:2] == ["--batch"]:
+        return run_batch(sys.argv[2:])
     #   Initialize some variables
     chat_context = None
     # Initialize token usage count
     total_usage = 0  
     assistant_name = sys.argv[0].rpartition('.')[0]
+    #   The summary is written with the same shared client as the chat
+    MEMORY.summarize = chat_summarizer(
+        lambda: get_shared_client(API_KEY, OAI_HOST, OAI_SERVICE_ENDPOINT,
+                                  cache=RESPONSE_CACHE, scheduler=REQUEST_SCHEDULER,
+                                  metrics=METRICS),
+        OAI_SUMMARY_MODEL)
+    #   Continue an earlier session if its id was given, or start a new one
+    session_id = sys.argv[1] if len(sys.argv) > 1 else new_session_id()
+    if SESSION_STORE.exists(session_id):
+        chat_context = new_chat_context()
+        restored = SESSION_STORE.restore(session_id, chat_context, CONTEXT_WINDOW)
+        MEMORY.observe_turns(chat_context['messages'])
+        print(f"\nResuming session {session_id} ({restored} earlier turns).")
+    else:
+        print(f"\nSession {session_id}")
     print()
     
     #   A rather simple chat loop
@@ -132,24 +234,59 @@ def main():
     #   While the user enters some text - not 'quit'
     while len(user_text)>0 and (user_text.lower() != "quit"):
         
-        #   Use that user text to make the request
-        chat_context, usage = make_chat_request(user_text, chat_context, API_KEY)
-        #   Count usage every time
-        total_usage += usage  
-        
-        #   Get the last message - it should be the text response
-        assistant_turn = chat_context['messages'][-1]
+        #   Note what the user says about their tastes, and replace the
+        #   turns that are already in the summary with the memory turn
+        MEMORY.observe(user_text)
+        if chat_context:
+            MEMORY.compact(chat_context)
         
-        #   Show that response
-        print(f"{assistant_name} > {assistant_turn['content']}")
+        try:
+            if OAI_STREAM_RESPONSES:
+                #   Show the response one piece at a time as it arrives
+                print(f"{assistant_name} > ", end="", flush=True)
+                chat_context, usage = make_chat_request(user_text, chat_context, API_KEY,
+                                                        on_token=print_token,
+                                                        session_id=session_id)
+                print()
+            else:
+                #   Use that user text to make the request
+                chat_context, usage = make_chat_request(user_text, chat_context, API_KEY,
+                                                        session_id=session_id)
+            
+                #   Get the last message - it should be the text response
+                assistant_turn = chat_context['messages'][-1]
+            
+                #   Show that response
+                print(f"{assistant_name} > {assistant_turn['content']}")
+            #   Count usage every time
+            total_usage += usage  
+            #   The response has been shown, so now older turns can be
+            #   summarized in the background while the user types
+            MEMORY.refresh_async(chat_context)
+        except ChatRequestError as err:
+            #   The request failed even after retrying - let the user try again
+            print(f"Sorry, that request failed: {err}")
         print()
         
         #   Get the next user turn
         user_text = input(f"You > ").strip()
         print()
     
-    print(f"\n🔢 Total token usage in this session: {total_usage} tokens.\n")
+    #   The summaries of the memory cost tokens too
+    summary_usage = MEMORY.summary_tokens_used
+    if summary_usage:
+        print(f"\n🔢 Total token usage in this session: {total_usage + summary_usage} tokens "
+              f"({summary_usage} of them for summaries).\n")
+    else:
+        print(f"\n🔢 Total token usage in this session: {total_usage} tokens.\n")
+    if CONTEXT_WINDOW.trim_count:
+        print(f"✂️  Trimmed the chat history {CONTEXT_WINDOW.trim_count} times, "
+              f"saving about {CONTEXT_WINDOW.tokens_saved} prompt tokens.\n")
     
+    if OAI_METRICS_DUMP:
+        METRICS_REGISTRY.dump_prometheus(OAI_METRICS_DUMP)
+    SESSION_STORE.close()
+    MEMORY.close()
     return
 
 if __name__ == '__main__':
@@ -15,14 +15,50 @@
 #   Copyright by Author. All rights reserved. Not for reuse without express permissions.
 #
 
-import sys, datetime, json, random
-import requests
-from rebert.classes.data.KeyManager import KeyManager
-from rebert.classes.release.MovieNumbers import MovieNumbers
+import sys, os, time, random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.chat_client import get_shared_client, ChatRequestError
+from common.context_window import ContextWindow
+from common.release_cache import ReleaseCache
+from common.background import run_in_background
+from common.release_sources import ReleaseAggregator, ReleaseSource, file_source, cached_source
+from common.response_cache import ResponseCache
+from common.release_index import ReleaseIndex
+from common.release_types import default_classifier
+from common.prompt_builder import PromptBuilder
+from common.scheduler import RequestScheduler
+from common.metrics import Instrumentation, MetricsRegistry, JsonLinesSink, new_turn_record
+from common.session_store import SessionStore, new_session_id
+from common.chat_message import ChatMessage, ChatContext
+from common.memory import TieredMemory, chat_summarizer
 
 OAI_HOST = "https://api.openai.com"
 OAI_SERVICE_ENDPOINT = "/v1/chat/completions"
 OAI_MODEL = "gpt-4-turbo-preview"
+OAI_STREAM_RESPONSES = False
+OAI_CONTEXT_TOKEN_BUDGET = 3000
+CONTEXT_WINDOW = ContextWindow(OAI_CONTEXT_TOKEN_BUDGET)
+RELEASE_CACHE = ReleaseCache()
+RELEASE_EXPORTS = []
+RELEASE_SOURCE_TIMEOUT = 30.0  # exports only; The Numbers is always waited for
+RELEASES_PER_PROMPT = 7
+RELEASE_CLASSIFIER = default_classifier()
+RESPONSE_CACHE = ResponseCache()
+OAI_REQUESTS_PER_MINUTE = 500
+OAI_TOKENS_PER_MINUTE = 30000
+REQUEST_SCHEDULER = RequestScheduler(OAI_REQUESTS_PER_MINUTE, OAI_TOKENS_PER_MINUTE)
+OAI_METRICS_LOG = None
+OAI_METRICS_DUMP = None
+METRICS_REGISTRY = MetricsRegistry()
+METRICS = Instrumentation([METRICS_REGISTRY])
+if OAI_METRICS_LOG:
+    METRICS.add_sink(JsonLinesSink(OAI_METRICS_LOG))
+SESSION_STORE = SessionStore()
+OAI_RECENT_TURNS = 6
+OAI_SUMMARY_MODEL = "gpt-3.5-turbo"
+MEMORY = TieredMemory(recent_turns=OAI_RECENT_TURNS)
+MEMORY.attach(CONTEXT_WINDOW)  # trimmed turns still reach the summary
 
 MOVIE_RECOMMENDER_PERSONA_PROMPT = '''You are a movie critic who wants to make sure that you make the best movie recommendations. 
 Make sure that the movie you recommend satisfies the user across many movie attributes including genre, actors, visuals, music, 
@@ -43,104 +79,185 @@ Here is a list of recently released movies. The list contains the MOVIE TITLE, t
 Your responses should always focus on making movie recommendations that consider the release type when appropriate.'''
 
 def get_recent_releases(cutoff=0):
-    collector = MovieNumbers(name="MovieNumbers-p2.v1")
-    movie_list = collector.getRecentReleaseList()
+    collector_name = "MovieNumbers-p2.v1"
+    def collect_numbers():
+        from rebert.classes.release.MovieNumbers import MovieNumbers
+        collector = MovieNumbers(name=collector_name)
+        return collector.getRecentReleaseList()
+    # Local CSV/JSON exports are merged in, fetched alongside The Numbers.
+    # Only The Numbers is cached, so edits to the exports show up at once.
+    numbers = ReleaseSource(collector_name, collect_numbers, timeout=None)
+    sources = [cached_source(numbers, RELEASE_CACHE)]
+    sources += [file_source(path, RELEASE_SOURCE_TIMEOUT) for path in RELEASE_EXPORTS]
+    movie_list = ReleaseAggregator(sources).collect()
     if cutoff and len(movie_list) > cutoff:
         movie_list = random.sample(movie_list,k=cutoff)
     return movie_list
 
+def render_movie_block(movie):
+    # The release type comes from the primary (first) part of the notes
+    release_type = RELEASE_CLASSIFIER.classify_notes(movie['notes'])
+    return (f"\tMOVIE TITLE: {movie['title']}\n"
+            f"\tRELEASE TYPE: {release_type}\n"
+            f"\tOPENING DATE: {movie['opening_date_str']}\n")
+
+# Remembers the block of every movie, so only new or changed movies are rendered
+PROMPT_BUILDER = PromptBuilder(render_movie_block, ('title', 'notes', 'opening_date_str'),
+                               separator="\n", lead="\n")
+
 def create_prompt_data_str(movie_list=[]):
-    movie_info_str = ""
-    for movie in movie_list:
-        # Extract the primary release type from notes
-        notes = movie['notes']
-        release_type = "General Release"  # default
-        
-        if notes:
-            # Clean up and categorize the release type
-            note_parts = [part.strip() for part in notes.split(',')]
-            primary_note = note_parts[0].lower()
-            
-            if 'wide' in primary_note:
-                release_type = "Wide Release"
-            elif 'limited' in primary_note:
-                release_type = "Limited Release"
-            elif 'imax' in primary_note:
-                release_type = "IMAX Release"
-            elif 're-release' in primary_note:
-                release_type = "Re-release"
-            elif 'festival' in primary_note:
-                release_type = "Festival Release"
-            elif 'special' in primary_note:
-                release_type = "Special Engagement"
-        
-        data = f"\tMOVIE TITLE: {movie['title']}\n"
-        data += f"\tRELEASE TYPE: {release_type}\n"
-        data += f"\tOPENING DATE: {movie['opening_date_str']}\n"
-        movie_info_str += "\n" + data
-    return movie_info_str
+    return PROMPT_BUILDER.render_sections(movie_list)['movie_data_str']
+
+def load_chat_key():
+    # rebert is slow to import, and is only needed by the startup work
+    from rebert.classes.data.KeyManager import KeyManager
+    key_manager = KeyManager()
+    key_list = key_manager.findRecord(domain="api.openai.com")
+    return key_list[0]['key']
+
+def prepare_chat_context(cutoff=0):
+    all_releases = get_recent_releases()
+    # Label every release with its type so the type can be searched too
+    for movie, release_type in zip(all_releases, RELEASE_CLASSIFIER.classify(all_releases)):
+        movie['release_type'] = release_type
+    release_index = ReleaseIndex(all_releases)
+    movie_releases = all_releases
+    if cutoff and len(all_releases) > cutoff:
+        movie_releases = random.sample(all_releases, k=cutoff)
+    movie_info_str = create_prompt_data_str(movie_releases)
+    return new_chat_context(movie_info_str), release_index, movie_releases
+
+# Swap the releases in the system prompt for the ones that best match the
+# question, keeping earlier ones when fewer than k match
+def select_releases(chat_context, release_index, user_text, shown_releases, k=7):
+    movie_releases = release_index.top_k(user_text, k, fallback=shown_releases)
+    if movie_releases != shown_releases:
+        movie_info_str = create_prompt_data_str(movie_releases)
+        sprompt = PROMPT_BUILDER.format_prompt(MOVIE_RECOMMENDER_PERSONA_PROMPT,
+                                               movie_data_str=movie_info_str)
+        chat_context['messages'][0] = new_chat_turn("system", sprompt)
+    return movie_releases
 
 def new_chat_turn(role="",content=""):
-    turn = dict()
-    turn['role'] = role
-    turn['content'] = content
-    return turn
+    return ChatMessage(role, content)
 
 def new_chat_context(movie_data_str=""):
-    chat_context = dict()
+    chat_context = ChatContext()
     chat_context['model'] = OAI_MODEL
     chat_context['messages'] = list()    
-    sprompt = MOVIE_RECOMMENDER_PERSONA_PROMPT.format(movie_data_str=movie_data_str)
+    sprompt = PROMPT_BUILDER.format_prompt(MOVIE_RECOMMENDER_PERSONA_PROMPT,
+                                           movie_data_str=movie_data_str)
     system_turn = new_chat_turn("system",sprompt)
     chat_context['messages'].append(system_turn)
     return chat_context
 
-def make_chat_request(user_text="", chat_context=None, chat_key=None):
+def make_chat_request(user_text="", chat_context=None, chat_key=None, on_token=None, session_id=None):
     if not chat_context:
         raise Exception("No chat_context has been supplied")
     
+    turn_record = new_turn_record()
+    start = time.perf_counter()
     user_turn = new_chat_turn("user",user_text)
     chat_context['messages'].append(user_turn)
+    CONTEXT_WINDOW.trim(chat_context)
+    turn_record['prompt_build_s'] = time.perf_counter() - start
     
-    payload = json.dumps(chat_context)
-    
-    header = dict()
-    header['Content-Type'] = "application/json"
-    header['Authorization'] = f"Bearer {chat_key}"
-    
-    service_url = OAI_HOST + OAI_SERVICE_ENDPOINT
-    
-    response = requests.post(service_url,
-                             headers=header,
-                             data=payload)
-    resp_dict = response.json()
+    client = get_shared_client(chat_key, OAI_HOST, OAI_SERVICE_ENDPOINT,
+                               cache=RESPONSE_CACHE, scheduler=REQUEST_SCHEDULER,
+                               metrics=METRICS)
+    try:
+        if on_token:
+            resp_dict = client.stream_chat(chat_context, on_token, turn_record)
+        else:
+            resp_dict = client.post_chat(chat_context, turn_record)
+    except ChatRequestError:
+        chat_context['messages'].pop()
+        raise
     assistant_turn = resp_dict['choices'][0]['message']
     chat_context['messages'].append(assistant_turn)
+    if session_id:
+        SESSION_STORE.extend(session_id, (user_turn, assistant_turn))
     return chat_context
 
+def print_token(text):
+    print(text, end="", flush=True)
+
+# python recommender_2.0_hard.py --batch questions.jsonl answers.jsonl
+def run_batch(argv):
+    from common import batch
+    chat_key = load_chat_key()
+    base_context, release_index, sample_releases = prepare_chat_context(RELEASES_PER_PROMPT)
+    def answer(user_text):
+        chat_context = base_context.copy()
+        select_releases(chat_context, release_index, user_text,
+                        sample_releases, RELEASES_PER_PROMPT)
+        chat_context = make_chat_request(user_text, chat_context, chat_key)
+        return chat_context['messages'][-1]['content']
+    batch.main(argv, answer, METRICS, prog=f"{sys.argv[0]} --batch")
+    if OAI_METRICS_DUMP:
+        METRICS_REGISTRY.dump_prometheus(OAI_METRICS_DUMP)
+
 def main():
+    if sys.argv[1:2] == ["--batch"]:
+        return run_batch(sys.argv[2:])
     assistant_name = sys.argv[0].rpartition('.')[0]
+    chat_context = None
+    # Pass the id of an earlier session to continue it
+    session_id = sys.argv[1] if len(sys.argv) > 1 else new_session_id()
     
-    key_manager = KeyManager()
-    key_list = key_manager.findRecord(domain="api.openai.com")
-    chat_key = key_list[0]['key']
-    
-    movie_releases = get_recent_releases(cutoff=7) 
-    movie_info_str = create_prompt_data_str(movie_releases)
-    chat_context = new_chat_context(movie_info_str)
+    # Key lookup and release collection run in the background while the
+    # user types, and are only waited for by the first request
+    # (daemon threads, so quitting doesn't wait for the scrape)
+    key_future = run_in_background(load_chat_key)
+    context_future = run_in_background(prepare_chat_context, RELEASES_PER_PROMPT)
     
+    print(f"\nSession {session_id}")
     print()
     user_text = input(f"You > ").strip()
     print()
     
     while len(user_text)>0 and (user_text.lower() != "quit"):
-        chat_context = make_chat_request(user_text, chat_context, chat_key)
-        assistant_turn = chat_context['messages'][-1]
-        print(f"{assistant_name} > {assistant_turn['content']}")
+        if chat_context is None:
+            chat_key = key_future.result()
+            chat_context, release_index, shown_releases = context_future.result()
+            SESSION_STORE.restore(session_id, chat_context, CONTEXT_WINDOW)
+            MEMORY.observe_turns(chat_context['messages'])
+            MEMORY.summarize = chat_summarizer(
+                lambda: get_shared_client(chat_key, OAI_HOST, OAI_SERVICE_ENDPOINT,
+                                          cache=RESPONSE_CACHE, scheduler=REQUEST_SCHEDULER,
+                                          metrics=METRICS),
+                OAI_SUMMARY_MODEL)
+        shown_releases = select_releases(chat_context, release_index, user_text,
+                                         shown_releases, RELEASES_PER_PROMPT)
+        # Older turns live on in the memory turn (summary + preferences)
+        MEMORY.observe(user_text)
+        MEMORY.compact(chat_context)
+        try:
+            if OAI_STREAM_RESPONSES:
+                print(f"{assistant_name} > ", end="", flush=True)
+                chat_context = make_chat_request(user_text, chat_context, chat_key,
+                                                 on_token=print_token, session_id=session_id)
+                print()
+            else:
+                chat_context = make_chat_request(user_text, chat_context, chat_key,
+                                                 session_id=session_id)
+                assistant_turn = chat_context['messages'][-1]
+                print(f"{assistant_name} > {assistant_turn['content']}")
+            # Summarize in the background, after the response is on screen
+            MEMORY.refresh_async(chat_context)
+        except ChatRequestError as err:
+            print(f"Sorry, that request failed: {err}")
         print()
         user_text = input(f"You > ").strip()
         print()
     
+    if CONTEXT_WINDOW.trim_count:
+        print(f"Trimmed the chat history {CONTEXT_WINDOW.trim_count} times, "
+              f"saving about {CONTEXT_WINDOW.tokens_saved} prompt tokens.\n")
+    if OAI_METRICS_DUMP:
+        METRICS_REGISTRY.dump_prometheus(OAI_METRICS_DUMP)
+    SESSION_STORE.close()
+    MEMORY.close()
     return
 
 if __name__ == '__main__':
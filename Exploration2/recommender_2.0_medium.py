@@ -17,20 +17,29 @@
 #
 
 #   These are standard python modules/packages
-import sys, datetime, json, random
+import sys, os, time, random
 #
-#   If you got any version of Protype 1 working then you should have
-#   this available on your machine
-import requests
+#   The rebert class library (KeyManager and MovieNumbers) takes a while to
+#   import, so it is imported inside the functions that use it. Those run in
+#   the background while the user types their first question.
 #
-#   This comes from the rebert class library and manages API keys
-#   You should use it to store your OpenAI API key locally, so your
-#   key is not stored as a constant in the code.
-from rebert.classes.data.KeyManager import KeyManager
-#
-#   This is a class that collects data from a website called
-#   The Numbers: https://www.the-numbers.com/movies/release-schedule
-from rebert.classes.release.MovieNumbers import MovieNumbers
+#   The chat client shared by all of the prototypes lives in the 'common'
+#   folder at the top of this repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.chat_client import get_shared_client, ChatRequestError
+from common.context_window import ContextWindow
+from common.release_cache import ReleaseCache
+from common.background import run_in_background
+from common.release_sources import ReleaseAggregator, ReleaseSource, file_source, cached_source
+from common.response_cache import ResponseCache
+from common.release_index import ReleaseIndex
+from common.release_types import ReleaseTypeClassifier
+from common.prompt_builder import PromptBuilder
+from common.scheduler import RequestScheduler
+from common.metrics import Instrumentation, MetricsRegistry, JsonLinesSink, new_turn_record
+from common.session_store import SessionStore, new_session_id
+from common.chat_message import ChatMessage, ChatContext
+from common.memory import TieredMemory, chat_summarizer
 #
 #
 #
@@ -41,6 +50,73 @@ OAI_HOST = "https://api.openai.com"
 OAI_SERVICE_ENDPOINT = "/v1/chat/completions"
 OAI_MODEL = "gpt-4-turbo-preview"
 #
+#   Set this to True to print the response as it is generated, instead
+#   of waiting for the whole response to arrive
+OAI_STREAM_RESPONSES = False
+#
+#   The whole chat history is sent with every request. Once the history
+#   grows past this many tokens the oldest turns are dropped. The system
+#   turn with the release information is always kept.
+OAI_CONTEXT_TOKEN_BUDGET = 3000
+CONTEXT_WINDOW = ContextWindow(OAI_CONTEXT_TOKEN_BUDGET)
+#
+#   Release lists are cached on disk for a day, so the website is only
+#   visited by the first process that starts each day
+RELEASE_CACHE = ReleaseCache()
+#
+#   Release lists exported to local CSV or JSON files are merged with the
+#   list from The Numbers. All of the sources are collected at the same
+#   time, and a movie found in more than one is only listed once. The
+#   Numbers is always waited for, as before; an export that takes longer
+#   than RELEASE_SOURCE_TIMEOUT seconds is left out.
+RELEASE_EXPORTS = []
+RELEASE_SOURCE_TIMEOUT = 30.0
+#
+#   How many releases are described in the system prompt. For every question
+#   the releases that best match it are picked from the whole list.
+RELEASES_PER_PROMPT = 7
+#
+#   This prototype only needs to tell re-releases from new releases, and
+#   a re-release can be mentioned anywhere in the notes
+RERELEASE_CLASSIFIER = ReleaseTypeClassifier([("re-release", "Re-release")],
+                                             default="New Release", primary_only=False)
+#
+#   Responses are remembered so the same request is not paid for twice.
+#   Only requests with a temperature of 0 are cached.
+RESPONSE_CACHE = ResponseCache()
+#
+#   Failed requests are retried, and requests are paced to stay within the
+#   rate limits of your key. Set these to the limits of your account.
+OAI_REQUESTS_PER_MINUTE = 500
+OAI_TOKENS_PER_MINUTE = 30000
+REQUEST_SCHEDULER = RequestScheduler(OAI_REQUESTS_PER_MINUTE, OAI_TOKENS_PER_MINUTE)
+#
+#   Every request is measured (see common/metrics.py). The measurements are
+#   kept in METRICS_REGISTRY. Set OAI_METRICS_LOG to also write each turn to
+#   a JSON lines file, and OAI_METRICS_DUMP to write the counters and
+#   histograms in the Prometheus text format when the session ends.
+OAI_METRICS_LOG = None
+OAI_METRICS_DUMP = None
+METRICS_REGISTRY = MetricsRegistry()
+METRICS = Instrumentation([METRICS_REGISTRY])
+if OAI_METRICS_LOG:
+    METRICS.add_sink(JsonLinesSink(OAI_METRICS_LOG))
+#
+#   Every turn is added to a log for the session, so a chat can be picked up
+#   again later with:  python recommender_2.0_medium.py SESSION_ID
+SESSION_STORE = SessionStore()
+#
+#   Long chats keep a tiered memory (see common/memory.py): the latest
+#   OAI_RECENT_TURNS turns word for word, a summary of the older turns, and
+#   the likes and dislikes the user has mentioned. The summary is written by
+#   the cheaper OAI_SUMMARY_MODEL in the background, after each response.
+OAI_RECENT_TURNS = 6
+OAI_SUMMARY_MODEL = "gpt-3.5-turbo"
+MEMORY = TieredMemory(recent_turns=OAI_RECENT_TURNS)
+#   Turns the context window has to drop before they are in the summary are
+#   handed to the memory, so they are still summarized
+MEMORY.attach(CONTEXT_WINDOW)
+#
 #   Updated prompt to distinguish between new releases and re-releases
 #
 MOVIE_RECOMMENDER_PERSONA_PROMPT = '''You are a movie critic who wants to make sure that you make the best movie recommendations. Make sure that the movie you recommend satisfies the user across many movie attributes including genre, actors, visuals, music, plot line, character development, dialog, mood, and many other movie attributes. 
@@ -64,9 +140,23 @@ def get_recent_releases(cutoff=0):
     #   Use a MovieNumbers object to get some movie data
     #   MovieNumbers does not use an API key. The data is
     #   collected from public web pages and uses screen
-    #   scraping to parse the HTML and collect data
-    collector = MovieNumbers(name="MovieNumbers-p2.v0")
-    movie_list = collector.getRecentReleaseList()
+    #   scraping to parse the HTML and collect data. The collector is
+    #   only used when there is no list for today in the release cache
+    collector_name = "MovieNumbers-p2.v0"
+    def collect_numbers():
+        #   This is a class that collects data from a website called
+        #   The Numbers: https://www.the-numbers.com/movies/release-schedule
+        from rebert.classes.release.MovieNumbers import MovieNumbers
+        collector = MovieNumbers(name=collector_name)
+        return collector.getRecentReleaseList()
+    #   Only the list from The Numbers is cached. The exports are local
+    #   files, so they are read again every time and changes show up at once.
+    #   The Numbers is the main source, so it has no timeout
+    numbers = ReleaseSource(collector_name, collect_numbers, timeout=None)
+    sources = [cached_source(numbers, RELEASE_CACHE)]
+    sources += [file_source(path, RELEASE_SOURCE_TIMEOUT) for path in RELEASE_EXPORTS]
+    aggregator = ReleaseAggregator(sources)
+    movie_list = aggregator.collect()
     #
     #   Create a subset if there is a lot of releases
     #   If cutoff is set to 0 (zero) then it returns 
@@ -76,121 +166,199 @@ def get_recent_releases(cutoff=0):
         movie_list = random.sample(movie_list,k=cutoff)
     return movie_list
 #
+#   Check if this is a re-release (notes contain "re-release")
+def is_rerelease(movie):
+    return RERELEASE_CLASSIFIER.classify_notes(movie['notes']) == "Re-release"
+#
+#   Which section of the prompt a movie goes in
+def movie_section(movie):
+    return "rereleases_str" if is_rerelease(movie) else "new_releases_str"
+#
+#   The block of text that describes one movie
+def render_movie_block(movie):
+    note = (movie['notes'] or "").partition(',')[0]
+    if is_rerelease(movie):
+        return (f"\tMOVIE TITLE: {movie['title']}\n"
+                f"\tRELEASE TYPE: {note}\n"
+                f"\tORIGINAL RELEASE DATE: {movie.get('original_date_str', 'Unknown')}\n"
+                f"\tRE-RELEASE DATE: {movie['opening_date_str']}\n")
+    return (f"\tMOVIE TITLE: {movie['title']}\n"
+            f"\tRELEASE TYPE: {note}\n"
+            f"\tOPENING DATE: {movie['opening_date_str']}\n")
+#
+#   The prompt builder remembers the block of every movie it has seen, so
+#   only new or changed movies are rendered, and it remembers whole prompts
+PROMPT_BUILDER = PromptBuilder(render_movie_block,
+                               ('title', 'notes', 'opening_date_str', 'original_date_str'),
+                               sections=("new_releases_str", "rereleases_str"),
+                               section_of=movie_section)
+#
 #   Generate separate strings for new releases and re-releases
 def create_prompt_data_str(movie_list=[]):
-    new_releases = []
-    rereleases = []
-    
-    for movie in movie_list:
-        # Check if this is a re-release (notes contain "re-release")
-        if 're-release' in movie['notes'].lower():
-            data = f"\tMOVIE TITLE: {movie['title']}\n"
-            note = movie['notes'].partition(',')[0]
-            data += f"\tRELEASE TYPE: {note}\n"
-            data += f"\tORIGINAL RELEASE DATE: {movie.get('original_date_str', 'Unknown')}\n"
-            data += f"\tRE-RELEASE DATE: {movie['opening_date_str']}\n"
-            rereleases.append(data)
-        else:
-            data = f"\tMOVIE TITLE: {movie['title']}\n"
-            note = movie['notes'].partition(',')[0]
-            data += f"\tRELEASE TYPE: {note}\n"
-            data += f"\tOPENING DATE: {movie['opening_date_str']}\n"
-            new_releases.append(data)
-    
-    # Join all entries with double newlines
-    new_releases_str = "\n".join(new_releases)
-    rereleases_str = "\n".join(rereleases)
-    
-    return new_releases_str, rereleases_str
+    sections = PROMPT_BUILDER.render_sections(movie_list)
+    return sections['new_releases_str'], sections['rereleases_str']
+#
+#   Look up the OpenAI API key with the key manager
+def load_chat_key():
+    #   This comes from the rebert class library and manages API keys
+    #   You should use it to store your OpenAI API key locally, so your
+    #   key is not stored as a constant in the code.
+    from rebert.classes.data.KeyManager import KeyManager
+    #   Create a key manager object - it automatically loads
+    #   the available key information - if you added a key    
+    key_manager = KeyManager()
+    #
+    #   Returns a list of keys - should only be one
+    key_list = key_manager.findRecord(domain="api.openai.com")
+    #
+    #   Extract just the api key from the key record
+    return key_list[0]['key']
+#
+#   Collect the release information, build a search index over all of the
+#   releases, and build the chat context with a system prompt that describes
+#   a first (random) set of them. Returns the chat context, the index and
+#   the releases that are in the prompt.
+def prepare_chat_context(cutoff=0):
+    #
+    #   Get all of the recent release information
+    all_releases = get_recent_releases()
+    release_index = ReleaseIndex(all_releases)
+    movie_releases = all_releases
+    if cutoff and len(all_releases) > cutoff:
+        movie_releases = random.sample(all_releases, k=cutoff)
+    #
+    #   Convert the movie data to separate strings for new releases and re-releases
+    new_releases_str, rereleases_str = create_prompt_data_str(movie_releases)
+    #
+    #   Create the chat context with separate sections for new releases and re-releases
+    chat_context = new_chat_context(new_releases_str, rereleases_str)
+    return chat_context, release_index, movie_releases
+#
+#   Put the releases that best match the user's question into the system
+#   prompt. Releases from the previous prompt fill any remaining places, so
+#   a follow-up question like "which of those is best?" keeps them.
+#   Returns the releases that are now in the prompt.
+def select_releases(chat_context, release_index, user_text, shown_releases, k=7):
+    movie_releases = release_index.top_k(user_text, k, fallback=shown_releases)
+    if movie_releases != shown_releases:
+        new_releases_str, rereleases_str = create_prompt_data_str(movie_releases)
+        sprompt = PROMPT_BUILDER.format_prompt(MOVIE_RECOMMENDER_PERSONA_PROMPT,
+                                               new_releases_str=new_releases_str,
+                                               rereleases_str=rereleases_str)
+        chat_context['messages'][0] = new_chat_turn("system", sprompt)
+    return movie_releases
 #
 #   Create a new chat turn.
-#   Each chat turn is a dictionary with a 'role' and 'content'
+#   Each chat turn has a 'role' and 'content', and can be used like a
+#   dictionary. It remembers its own JSON, so it is only encoded once.
 def new_chat_turn(role="",content=""):
-    turn = dict()
-    turn['role'] = role
-    turn['content'] = content
-    return turn
+    return ChatMessage(role, content)
 #
 #   The program needs to maintain the status of the chat. This status 
 #   will include parameters that tell the model how it should respond
 #   as well as all of the user questions and the responses.
 #   This procedure creates a chat context to maintain that status.
 def new_chat_context(new_releases_str="", rereleases_str=""):
-    chat_context = dict()
+    chat_context = ChatContext()
     chat_context['model'] = OAI_MODEL
     chat_context['messages'] = list()    
-    sprompt = MOVIE_RECOMMENDER_PERSONA_PROMPT.format(
-        new_releases_str=new_releases_str,
-        rereleases_str=rereleases_str
-    )
+    sprompt = PROMPT_BUILDER.format_prompt(MOVIE_RECOMMENDER_PERSONA_PROMPT,
+                                           new_releases_str=new_releases_str,
+                                           rereleases_str=rereleases_str)
     system_turn = new_chat_turn("system", sprompt)
     chat_context['messages'].append(system_turn)
     return chat_context
 #
 #   Making a request is about modifying the growing chat_context,
 #   setting up the HTTP request URL and request headers, and making
-#   the request.
-def make_chat_request(user_text="", chat_context=None, chat_key=None):
+#   the request. If on_token is given the response is streamed, and
+#   on_token is called with each piece of text as it arrives. If a
+#   session_id is given the new turns are saved in the session log.
+def make_chat_request(user_text="", chat_context=None, chat_key=None, on_token=None, session_id=None):
     #   If there is no chat context, raise an error
     if not chat_context:
         raise Exception("No chat_context has been supplied")
     
+    #   Time how long it takes to get the messages ready
+    turn_record = new_turn_record()
+    start = time.perf_counter()
     #   We use the text we got from the user to create a user turn
     user_turn = new_chat_turn("user",user_text)
     #   Add that user turn to the list of messages in the context
     chat_context['messages'].append(user_turn)
+    #   Drop old turns if the history has grown past the token budget
+    CONTEXT_WINDOW.trim(chat_context)
+    turn_record['prompt_build_s'] = time.perf_counter() - start
     
-    #   The whole context is payload for the request - a request body
-    payload = json.dumps(chat_context)
-    
-    #   Create header information for the request - this must include
-    #   the 'Content-Type' key set to 'application/json' and the
-    #   'Authorization' key set to include your API key
-    header = dict()
-    header['Content-Type'] = "application/json"
-    header['Authorization'] = f"Bearer {chat_key}"
-    
-    #   The service URL is the host and the service endpoint
-    service_url = OAI_HOST + OAI_SERVICE_ENDPOINT
-    
-    #   Make this as a POST request
-    response = requests.post(service_url,
-                             headers=header,
-                             data=payload)
-    #   The response should be 'application/json' so extract the JSON
-    resp_dict = response.json()
+    #   The whole context is payload for the request. The shared client
+    #   keeps its connection to the service open between turns and already
+    #   has the request headers with your API key
+    client = get_shared_client(chat_key, OAI_HOST, OAI_SERVICE_ENDPOINT,
+                               cache=RESPONSE_CACHE, scheduler=REQUEST_SCHEDULER,
+                               metrics=METRICS)
+    try:
+        if on_token:
+            resp_dict = client.stream_chat(chat_context, on_token, turn_record)
+        else:
+            resp_dict = client.post_chat(chat_context, turn_record)
+    except ChatRequestError:
+        #   Take the user turn back out so the chat can carry on
+        chat_context['messages'].pop()
+        raise
     #   There is a lot in the response - just extract the message
     assistant_turn = resp_dict['choices'][0]['message']
     #   Add the response to our chat context
     chat_context['messages'].append(assistant_turn)
+    #   Only the two new turns are written, never the whole history
+    if session_id:
+        SESSION_STORE.extend(session_id, (user_turn, assistant_turn))
     return chat_context
 
+#
+#   Print a piece of a streamed response without starting a new line
+def print_token(text):
+    print(text, end="", flush=True)
+
+#
+#   Batch mode answers a whole file of questions without the chat loop:
+#       python recommender_2.0_medium.py --batch questions.jsonl answers.jsonl
+#   Every question starts from a copy of the same chat context, with the
+#   releases that best match that question.
+def run_batch(argv):
+    from common import batch
+    chat_key = load_chat_key()
+    base_context, release_index, sample_releases = prepare_chat_context(RELEASES_PER_PROMPT)
+    def answer(user_text):
+        chat_context = base_context.copy()
+        select_releases(chat_context, release_index, user_text,
+                        sample_releases, RELEASES_PER_PROMPT)
+        chat_context = make_chat_request(user_text, chat_context, chat_key)
+        return chat_context['messages'][-1]['content']
+    batch.main(argv, answer, METRICS, prog=f"{sys.argv[0]} --batch")
+    if OAI_METRICS_DUMP:
+        METRICS_REGISTRY.dump_prometheus(OAI_METRICS_DUMP)
+
 #
 #   The main is called from the command line and just loops asking
 #   for user ask a question.
 def main():
+    if sys.argv[1:2] == ["--batch"]:
+        return run_batch(sys.argv[2:])
     #   Initialize some variables
     assistant_name = sys.argv[0].rpartition('.')[0]
+    chat_context = None
+    #   Continue an earlier session if its id was given, or start a new one
+    session_id = sys.argv[1] if len(sys.argv) > 1 else new_session_id()
     
-    #   Create a key manager object - it automatically loads
-    #   the available key information - if you added a key    
-    key_manager = KeyManager()
-    #
-    #   Returns a list of keys - should only be one
-    key_list = key_manager.findRecord(domain="api.openai.com")
-    #
-    #   Extract just the api key from the key record
-    chat_key = key_list[0]['key']
-    #
-    #   Get some recent release information
-    movie_releases = get_recent_releases(cutoff=7) 
-    #
-    #   Convert the movie data to separate strings for new releases and re-releases
-    new_releases_str, rereleases_str = create_prompt_data_str(movie_releases)
-    #
-    #   Create the chat context with separate sections for new releases and re-releases
-    chat_context = new_chat_context(new_releases_str, rereleases_str)
+    #   Look up the key and collect the release information in the
+    #   background, at the same time, while the user types their first
+    #   question. The results are only waited for when the first
+    #   request needs them.
+    #   They run in daemon threads, so quitting doesn't wait for them.
+    key_future = run_in_background(load_chat_key)
+    context_future = run_in_background(prepare_chat_context, RELEASES_PER_PROMPT)
     
+    print(f"\nSession {session_id}")
     print()
     #   A rather simple chat loop
     user_text = input(f"You > ").strip()
@@ -198,20 +366,65 @@ def main():
     #   While the user enters some text - not 'quit'
     while len(user_text)>0 and (user_text.lower() != "quit"):
         
-        #   Use that user text to make the request
-        chat_context = make_chat_request(user_text, chat_context, chat_key)
-        
-        #   Get the last message - it should be the text response
-        assistant_turn = chat_context['messages'][-1]
+        #   The first request waits for the startup work to finish
+        if chat_context is None:
+            chat_key = key_future.result()
+            chat_context, release_index, shown_releases = context_future.result()
+            #   Put back the recent turns of an earlier session
+            SESSION_STORE.restore(session_id, chat_context, CONTEXT_WINDOW)
+            MEMORY.observe_turns(chat_context['messages'])
+            #   The summary is written with the same shared client as the chat
+            MEMORY.summarize = chat_summarizer(
+                lambda: get_shared_client(chat_key, OAI_HOST, OAI_SERVICE_ENDPOINT,
+                                          cache=RESPONSE_CACHE, scheduler=REQUEST_SCHEDULER,
+                                          metrics=METRICS),
+                OAI_SUMMARY_MODEL)
+        #
+        #   Describe the releases that are relevant to this question
+        shown_releases = select_releases(chat_context, release_index, user_text,
+                                         shown_releases, RELEASES_PER_PROMPT)
+        #
+        #   Note what the user says about their tastes, and replace the
+        #   turns that are already in the summary with the memory turn
+        MEMORY.observe(user_text)
+        MEMORY.compact(chat_context)
         
-        #   Show that response
-        print(f"{assistant_name} > {assistant_turn['content']}")
+        try:
+            if OAI_STREAM_RESPONSES:
+                #   Show the response one piece at a time as it arrives
+                print(f"{assistant_name} > ", end="", flush=True)
+                chat_context = make_chat_request(user_text, chat_context, chat_key,
+                                                 on_token=print_token, session_id=session_id)
+                print()
+            else:
+                #   Use that user text to make the request
+                chat_context = make_chat_request(user_text, chat_context, chat_key,
+                                                 session_id=session_id)
+            
+                #   Get the last message - it should be the text response
+                assistant_turn = chat_context['messages'][-1]
+            
+                #   Show that response
+                print(f"{assistant_name} > {assistant_turn['content']}")
+            #   The response has been shown, so now older turns can be
+            #   summarized in the background while the user types
+            MEMORY.refresh_async(chat_context)
+        except ChatRequestError as err:
+            #   The request failed even after retrying - let the user try again
+            print(f"Sorry, that request failed: {err}")
         print()
         
         #   Get the next user turn
         user_text = input(f"You > ").strip()
         print()
     
+    if CONTEXT_WINDOW.trim_count:
+        print(f"Trimmed the chat history {CONTEXT_WINDOW.trim_count} times, "
+              f"saving about {CONTEXT_WINDOW.tokens_saved} prompt tokens.\n")
+    if OAI_METRICS_DUMP:
+        METRICS_REGISTRY.dump_prometheus(OAI_METRICS_DUMP)
+    SESSION_STORE.close()
+    MEMORY.close()
     return
 
 if __name__ == '__main__':
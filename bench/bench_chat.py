@@ -0,0 +1,260 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#   FILE: bench_chat.py
+#   CREATION DATE: October, 2026
+#
+#   End-to-end latency and throughput benchmark for the recommender prototypes.
+#
+#   Each prototype is loaded from its file and pointed at a local mock chat
+#   service (common/mock_server.py). Scripted multi-turn sessions are then
+#   run through its make_chat_request() at several concurrency levels. For
+#   every prototype and level the benchmark reports turn latency percentiles,
+#   the time to serialize the chat_context, the request payload size per
+#   turn and the number of turns per second.
+#
+#   Run it from the top of the repository with
+#       python bench/bench_chat.py --concurrency 1 8 32 --save bench_results.json
+#   and compare a later run against saved results with --baseline.
+#
+
+import os, sys, json, time, argparse, importlib.util
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+from common.mock_server import MockChatServer
+from common.batch import TurnCollector
+from common.chat_client import close_shared_clients
+from common.scheduler import RequestScheduler
+
+#   CONSTANTS
+#
+#   The prototypes to measure, by name and file
+VARIANTS = (
+    ("1.1", os.path.join(REPO_DIR, "Exploration1", "recommender_1.1.py")),
+    ("2.0_medium", os.path.join(REPO_DIR, "Exploration2", "recommender_2.0_medium.py")),
+    ("2.0_hard", os.path.join(REPO_DIR, "Exploration2", "recommender_2.0_hard.py")),
+)
+#
+#   Every session asks these questions in order
+SCRIPTED_TURNS = (
+    "I want to see something funny this weekend.",
+    "Anything with great visuals? I have an IMAX theater nearby.",
+    "I didn't like the last superhero movie I saw, please avoid those.",
+    "What about a classic that is back in theaters?",
+    "Great, which of those would be best for a date night?",
+)
+#
+#   A stand-in release list, so the benchmark does not visit The Numbers
+SAMPLE_RELEASES = [
+    {'title': "The Long Weekend", 'notes': "Wide", 'opening_date_str': "October 17, 2026"},
+    {'title': "Ocean Light", 'notes': "IMAX", 'opening_date_str': "October 17, 2026"},
+    {'title': "Night Shift", 'notes': "Limited", 'opening_date_str': "October 17, 2026"},
+    {'title': "Casablanca", 'notes': "Re-release, 4K restoration",
+     'opening_date_str': "October 18, 2026", 'original_date_str': "November 26, 1942"},
+    {'title': "Paper Kites", 'notes': "Festival, TIFF selection", 'opening_date_str': "October 24, 2026"},
+    {'title': "The Last Show", 'notes': "Special engagement", 'opening_date_str': "October 24, 2026"},
+    {'title': "Harbor Town", 'notes': "Wide", 'opening_date_str': "October 24, 2026"},
+]
+DEFAULT_CONCURRENCY = (1, 8, 32)
+DEFAULT_SESSIONS_PER_WORKER = 4
+BENCH_KEY = "benchmark-key"
+#
+#   The rate limits of the scheduler used in the benchmark. They are far
+#   above what the mock service is asked for, so requests go through the
+#   scheduler (and its retries) without being held back by the limits of a
+#   real key.
+BENCH_REQUESTS_PER_MINUTE = 1000000
+BENCH_TOKENS_PER_MINUTE = 1000000000
+
+
+#
+#   Load a prototype file as a module. The prototype files have dots in
+#   their names so they can't be imported in the usual way.
+def load_variant(name, path):
+    module_name = "bench_variant_" + name.replace(".", "_")
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+#
+#   The first chat_context for a session. Prototype 1 makes its own
+#   context on the first request, the others need the release list.
+def start_context(module):
+    if not hasattr(module, "create_prompt_data_str"):
+        return None
+    prompt_data = module.create_prompt_data_str(SAMPLE_RELEASES)
+    if isinstance(prompt_data, tuple):
+        return module.new_chat_context(*prompt_data)
+    return module.new_chat_context(prompt_data)
+
+#
+#   Run one scripted session and return a measurement for every turn.
+#   The serialize time and payload size are the ones the client recorded
+#   for the request it sent. A turn that sent no request (a cache hit, or
+#   one shared with an identical request) has none.
+def run_session(module, collector):
+    chat_context = start_context(module)
+    turns = list()
+    for user_text in SCRIPTED_TURNS:
+        collector.start()
+        start = time.perf_counter()
+        result = module.make_chat_request(user_text, chat_context, BENCH_KEY)
+        latency = time.perf_counter() - start
+        chat_context = result[0] if isinstance(result, tuple) else result
+        record = collector.last_turn()
+        turn = dict()
+        turn['latency'] = latency
+        turn['serialize'] = None
+        turn['payload_bytes'] = None
+        if record and record['payload_bytes']:
+            turn['serialize'] = record['serialize_s']
+            turn['payload_bytes'] = record['payload_bytes']
+        turns.append(turn)
+    return turns
+
+#
+#   The value below which the given percent of the values fall
+def percentile(values, percent):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(percent / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+def summarize(turns, wall_time):
+    latencies = [turn['latency'] for turn in turns]
+    serialize = [turn['serialize'] for turn in turns if turn['serialize'] is not None]
+    payload = [turn['payload_bytes'] for turn in turns if turn['payload_bytes'] is not None]
+    summary = dict()
+    summary['turns'] = len(turns)
+    summary['p50_ms'] = percentile(latencies, 50) * 1000
+    summary['p95_ms'] = percentile(latencies, 95) * 1000
+    summary['p99_ms'] = percentile(latencies, 99) * 1000
+    summary['serialize_p50_us'] = percentile(serialize, 50) * 1e6
+    summary['payload_bytes_avg'] = sum(payload) / len(payload) if payload else 0
+    summary['turns_per_second'] = len(turns) / wall_time if wall_time else 0.0
+    return summary
+
+#
+#   Run the sessions for one prototype at one concurrency level
+def bench_variant(module, concurrency, sessions_per_worker, collector):
+    session_count = concurrency * sessions_per_worker
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: run_session(module, collector), range(session_count)))
+    wall_time = time.perf_counter() - start
+    turns = [turn for session_turns in results for turn in session_turns]
+    return summarize(turns, wall_time)
+
+def print_table(results):
+    columns = ("variant", "conc", "turns", "p50_ms", "p95_ms", "p99_ms",
+               "serialize_p50_us", "payload_bytes_avg", "turns_per_second")
+    print("  ".join(f"{column:>12}" for column in columns))
+    for row in results:
+        if row.get('skipped'):
+            print(f"{row['variant']:>12}  skipped: {row['skipped']}")
+            continue
+        cells = [f"{row['variant']:>12}", f"{row['concurrency']:>12}"]
+        for column in columns[2:]:
+            value = row[column]
+            cells.append(f"{value:>12.1f}" if isinstance(value, float) else f"{value:>12}")
+        print("  ".join(cells))
+
+#
+#   Compare p95 latency and throughput against a saved run. Returns
+#   a list of regressions larger than the allowed fraction. Runs with
+#   and without --coalesce are not compared with each other.
+def compare_to_baseline(results, baseline, max_regression):
+    previous = {(row['variant'], row.get('concurrency'), row.get('coalesce', False)): row
+                for row in baseline if not row.get('skipped')}
+    regressions = list()
+    for row in results:
+        old = previous.get((row['variant'], row.get('concurrency'), row.get('coalesce', False)))
+        if row.get('skipped') or not old:
+            continue
+        if row['p95_ms'] > old['p95_ms'] * (1 + max_regression):
+            regressions.append(f"{row['variant']} x{row['concurrency']}: p95 "
+                               f"{old['p95_ms']:.1f} -> {row['p95_ms']:.1f} ms")
+        if row['turns_per_second'] < old['turns_per_second'] * (1 - max_regression):
+            regressions.append(f"{row['variant']} x{row['concurrency']}: throughput "
+                               f"{old['turns_per_second']:.1f} -> {row['turns_per_second']:.1f} turns/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the recommender prototypes against a mock service")
+    parser.add_argument("--variants", nargs="*", default=[name for name, path in VARIANTS])
+    parser.add_argument("--concurrency", nargs="*", type=int, default=list(DEFAULT_CONCURRENCY))
+    parser.add_argument("--sessions-per-worker", type=int, default=DEFAULT_SESSIONS_PER_WORKER)
+    parser.add_argument("--latency", type=float, default=0.05, help="mock service latency in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=0)
+    parser.add_argument("--completion-tokens", type=int, default=60)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against results saved with --save")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="allowed slowdown against the baseline, as a fraction")
+    parser.add_argument("--coalesce", action="store_true",
+                        help="share a request with an identical one in flight; the scripted "
+                             "sessions are all alike, so this measures far fewer requests")
+    args = parser.parse_args()
+
+    server = MockChatServer(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                            completion_tokens=args.completion_tokens).start()
+    results = list()
+    try:
+        for name, path in VARIANTS:
+            if name not in args.variants:
+                continue
+            try:
+                module = load_variant(name, path)
+            except ImportError as err:
+                results.append({'variant': name, 'skipped': str(err)})
+                continue
+            module.OAI_HOST = server.url
+            #   Every turn record the client makes is also given to the
+            #   collector, in the thread of the session that made it
+            collector = TurnCollector()
+            module.METRICS.add_sink(collector)
+            module.REQUEST_SCHEDULER = RequestScheduler(BENCH_REQUESTS_PER_MINUTE,
+                                                        BENCH_TOKENS_PER_MINUTE,
+                                                        max_queue=max(args.concurrency))
+            #   Create the shared client up front so its pool is big enough
+            #   for the highest concurrency level. It gets the same cache,
+            #   scheduler and metrics make_chat_request() passes, so every
+            #   layer of a real turn is measured.
+            module.get_shared_client(BENCH_KEY, module.OAI_HOST, module.OAI_SERVICE_ENDPOINT,
+                                     pool_size=max(args.concurrency),
+                                     cache=module.RESPONSE_CACHE,
+                                     scheduler=module.REQUEST_SCHEDULER,
+                                     metrics=module.METRICS,
+                                     coalesce=args.coalesce)
+            for concurrency in args.concurrency:
+                row = bench_variant(module, concurrency, args.sessions_per_worker, collector)
+                row['variant'] = name
+                row['concurrency'] = concurrency
+                row['coalesce'] = args.coalesce
+                results.append(row)
+            #   The prototypes share common.chat_client, so the next one
+            #   would otherwise be given this one's client
+            close_shared_clients()
+    finally:
+        server.stop()
+
+    print_table(results)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as save_file:
+            json.dump(results, save_file, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as baseline_file:
+            regressions = compare_to_baseline(results, json.load(baseline_file), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+    return
+
+if __name__ == '__main__':
+    main()
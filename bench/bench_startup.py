@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#   FILE: bench_startup.py
+#   CREATION DATE: October, 2026
+#
+#   Cold start benchmark for the recommender prototypes.
+#
+#   A new process is started for every chat session, so the time before the
+#   first "You >" prompt is time every user waits. For each prototype this
+#   benchmark measures, in fresh processes:
+#
+#   - the import time of the prototype (without running main), using
+#     python -X importtime, and the top-level imports that cost the most
+#   - the wall time from starting the process to the first "You >" prompt
+#
+#   Run it from the top of the repository with
+#       python bench/bench_startup.py --save startup_results.json
+#   and compare a later run against saved results with --baseline.
+#
+
+import os, sys, json, time, argparse, tempfile, threading, subprocess, statistics
+
+from bench_chat import VARIANTS
+
+#   CONSTANTS
+#
+DEFAULT_RUNS = 5
+DEFAULT_TOP_IMPORTS = 8
+PROMPT = b"You >"
+PROMPT_TIMEOUT = 30.0
+#
+#   Loads a prototype the way the benchmarks do, without running main()
+LOAD_SNIPPET = ("import sys, importlib.util; "
+                "spec = importlib.util.spec_from_file_location('prototype', sys.argv[1]); "
+                "module = importlib.util.module_from_spec(spec); "
+                "spec.loader.exec_module(module)")
+
+
+#
+#   The top-level imports in the -X importtime output, as {name: ms}
+def top_level_imports(stderr):
+    imports = dict()
+    for line in stderr.splitlines():
+        parts = line[len("import time:"):].split("|")
+        if not line.startswith("import time:") or len(parts) != 3:
+            continue
+        #   Nested imports are indented two more spaces under the import
+        #   that caused them
+        name = parts[2]
+        if parts[1].strip().isdigit() and not name.startswith("  "):
+            imports[name.strip()] = int(parts[1]) / 1000.0
+    return imports
+
+#
+#   Import the prototype in a fresh process with -X importtime. Returns the
+#   total import time in ms and its costliest top-level imports, or raises
+#   RuntimeError when the prototype can't be imported. Modules the
+#   interpreter imports for itself (like site) are not counted.
+def measure_imports(path):
+    interpreter = subprocess.run([sys.executable, "-X", "importtime", "-c", "import importlib.util"],
+                                 capture_output=True, text=True)
+    already_imported = set(top_level_imports(interpreter.stderr))
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", LOAD_SNIPPET, path],
+                               capture_output=True, text=True)
+    if completed.returncode != 0:
+        last_line = (completed.stderr.strip().splitlines() or ["failed"])[-1]
+        raise RuntimeError(last_line)
+    imports = dict((name, ms) for name, ms in top_level_imports(completed.stderr).items()
+                   if name not in already_imported)
+    return sum(imports.values()), sorted(imports.items(), key=lambda item: -item[1])
+
+#
+#   Start the prototype and return the seconds until it shows the first
+#   "You >" prompt. The prototype is then told to quit.
+def time_to_prompt(path, session_dir):
+    env = dict(os.environ)
+    env['RECOMMENDER_SESSION_DIR'] = session_dir
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-u", path], cwd=os.path.dirname(path),
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, env=env)
+    timer = threading.Timer(PROMPT_TIMEOUT, process.kill)
+    timer.start()
+    output = b""
+    try:
+        while PROMPT not in output:
+            data = process.stdout.read1(4096)
+            if not data:
+                raise RuntimeError("exited before showing the prompt")
+            output += data
+        elapsed = time.perf_counter() - start
+        process.stdin.write(b"quit\n")
+        process.stdin.flush()
+        process.communicate(timeout=PROMPT_TIMEOUT)
+    finally:
+        timer.cancel()
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+    return elapsed
+
+#
+#   Measure one prototype over several runs and report the medians
+def bench_variant(path, runs, top_imports):
+    import_times = list()
+    prompt_times = list()
+    costliest = None
+    with tempfile.TemporaryDirectory(prefix="bench-sessions-") as session_dir:
+        for run in range(runs):
+            total, imports = measure_imports(path)
+            import_times.append(total)
+            costliest = costliest or imports
+            prompt_times.append(time_to_prompt(path, session_dir) * 1000.0)
+    row = dict()
+    row['runs'] = runs
+    row['import_ms'] = statistics.median(import_times)
+    row['prompt_ms'] = statistics.median(prompt_times)
+    row['top_imports'] = [[name, round(ms, 2)] for name, ms in costliest[:top_imports]]
+    return row
+
+def print_results(results):
+    print()
+    print(f"{'variant':>12}  {'runs':>6}  {'import_ms':>10}  {'prompt_ms':>10}")
+    for row in results:
+        if row.get('skipped'):
+            print(f"{row['variant']:>12}  skipped: {row['skipped']}")
+            continue
+        print(f"{row['variant']:>12}  {row['runs']:>6}  {row['import_ms']:>10.1f}  {row['prompt_ms']:>10.1f}")
+    for row in results:
+        if row.get('skipped'):
+            continue
+        print(f"\nCostliest top-level imports of {row['variant']}:")
+        for name, ms in row['top_imports']:
+            print(f"    {ms:>8.2f} ms  {name}")
+    print()
+
+#
+#   Compare against a saved run. Returns a list of regressions larger than
+#   the allowed fraction.
+def compare_to_baseline(results, baseline, max_regression):
+    previous = {row['variant']: row for row in baseline if not row.get('skipped')}
+    regressions = list()
+    for row in results:
+        old = previous.get(row['variant'])
+        if row.get('skipped') or not old:
+            continue
+        for field in ('import_ms', 'prompt_ms'):
+            if row[field] > old[field] * (1 + max_regression):
+                regressions.append(f"{row['variant']}: {field} {old[field]:.1f} -> {row[field]:.1f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold start of the recommender prototypes")
+    parser.add_argument("--variants", nargs="*", default=[name for name, path in VARIANTS])
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS)
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP_IMPORTS,
+                        help="how many of the costliest imports to list")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against results saved with --save")
+    parser.add_argument("--max-regression", type=float, default=0.25,
+                        help="allowed slowdown against the baseline, as a fraction")
+    args = parser.parse_args()
+
+    results = list()
+    for name, path in VARIANTS:
+        if name not in args.variants:
+            continue
+        try:
+            row = bench_variant(path, args.runs, args.top)
+        except RuntimeError as err:
+            row = {'skipped': str(err)}
+        row['variant'] = name
+        results.append(row)
+
+    print_results(results)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as save_file:
+            json.dump(results, save_file, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as baseline_file:
+            regressions = compare_to_baseline(results, json.load(baseline_file), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+    return
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+#
+#   Helpers shared by the recommender prototypes in the Exploration folders.
+#
+#   The prototypes are run as scripts from their own folders, so each one
+#   adds the top of this repository to sys.path before importing from here.
+#
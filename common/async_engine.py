@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+#
+#   FILE: async_engine.py
+#   CREATION DATE: October, 2026
+#
+#   An asyncio chat engine that serves many conversations in one process.
+#
+#   The prototypes run one blocking input() loop per process. The engine
+#   keeps many independent chat contexts, made by the same new_chat_context()
+#   function a prototype uses, and sends their requests concurrently over one
+#   shared HTTP client. A semaphore limits how many requests are in flight,
+#   and a lock per session makes sure the turns of one conversation are sent
+#   in order, one at a time.
+#
+#   Sessions that send exactly the same request at the same time (the same
+#   opening question against the same system prompt, for example) share one
+#   request to the service (see single_flight.py).
+#
+#   The engine uses aiohttp when it is installed. Without it, requests are
+#   sent by a pooled ChatClient in worker threads. Either way a failed
+#   request raises a ChatRequestError, and with a RequestScheduler (see
+#   scheduler.py) it is retried and kept within the rate limits of the key.
+#
+
+import json, asyncio, itertools
+from concurrent.futures import ThreadPoolExecutor
+
+from common.chat_client import (OAI_HOST, OAI_SERVICE_ENDPOINT,
+                                DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT,
+                                ChatClient, ChatRequestError, _response_error)
+from common.context_window import estimate_message_tokens
+from common.chat_message import ChatMessage, encode_chat_body
+from common.single_flight import AsyncSingleFlight, FlightTimeout, flight_key
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+#   CONSTANTS
+#
+#   The most requests that are sent to the service at the same time
+DEFAULT_MAX_CONCURRENCY = 32
+
+
+#
+#   An AsyncChatEngine holds chat contexts by session id. The
+#   context_factory is called to create the context for a new session.
+class AsyncChatEngine(object):
+    def __init__(self, context_factory, api_key="", host=OAI_HOST, endpoint=OAI_SERVICE_ENDPOINT,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT,
+                 context_window=None, coalesce=True, scheduler=None):
+        self.context_factory = context_factory
+        self.api_key = api_key
+        self.service_url = host + endpoint
+        self.host = host
+        self.endpoint = endpoint
+        self.max_concurrency = max_concurrency
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        #   An optional ContextWindow used to trim every session
+        self.context_window = context_window
+        #   An optional RequestScheduler. It can be the same one the
+        #   threaded prototypes use, so they share the budget of the key.
+        self.scheduler = scheduler
+        #   Identical requests in flight at the same time are sent once
+        self.flights = AsyncSingleFlight(connect_timeout + read_timeout) if coalesce else None
+        self.sessions = dict()
+        self.usage = dict()
+        self._session_locks = dict()
+        self._session_ids = itertools.count(1)
+        self._semaphore = None
+        self._http = None
+        self._client = None
+        self._executor = None
+
+    #
+    #   Create the shared HTTP client. This must be called (or the engine
+    #   used with 'async with') from inside the running event loop.
+    async def start(self):
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if aiohttp:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+            timeout = aiohttp.ClientTimeout(connect=self.connect_timeout,
+                                            sock_read=self.read_timeout)
+            headers = dict()
+            headers['Content-Type'] = "application/json"
+            headers['Authorization'] = f"Bearer {self.api_key}"
+            self._http = aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                               headers=headers)
+        else:
+            self._client = ChatClient(self.api_key, self.host, self.endpoint,
+                                      pool_size=self.max_concurrency,
+                                      connect_timeout=self.connect_timeout,
+                                      read_timeout=self.read_timeout, coalesce=False)
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                thread_name_prefix="chat-engine")
+        return self
+
+    async def close(self):
+        if self._http:
+            await self._http.close()
+            self._http = None
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._client:
+            self._client.close()
+            self._client = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    #
+    #   Start a new conversation. Any extra arguments are passed to the
+    #   context_factory. Returns the session id.
+    def open_session(self, session_id=None, *args, **kwargs):
+        if session_id is None:
+            session_id = next(self._session_ids)
+        self.sessions[session_id] = self.context_factory(*args, **kwargs)
+        self.usage[session_id] = 0
+        self._session_locks[session_id] = asyncio.Lock()
+        return session_id
+
+    def close_session(self, session_id):
+        self._session_locks.pop(session_id, None)
+        self.usage.pop(session_id, None)
+        return self.sessions.pop(session_id, None)
+
+    #
+    #   Send a user turn in a session and return the assistant turn.
+    #   Turns sent to the same session are answered in the order sent.
+    async def send(self, session_id, user_text=""):
+        async with self._session_locks[session_id]:
+            chat_context = self.sessions[session_id]
+            user_turn = ChatMessage("user", user_text)
+            chat_context['messages'].append(user_turn)
+            if self.context_window:
+                self.context_window.trim(chat_context)
+            try:
+                resp_dict = await self._post_chat(chat_context)
+                assistant_turn = resp_dict['choices'][0]['message']
+            except BaseException:
+                #   Leave the session as it was before this turn
+                if chat_context['messages'] and chat_context['messages'][-1] is user_turn:
+                    chat_context['messages'].pop()
+                raise
+            chat_context['messages'].append(assistant_turn)
+            self.usage[session_id] += resp_dict.get("usage", {}).get("total_tokens", 0)
+            return assistant_turn
+
+    #
+    #   A request that shared the response of an identical one did not
+    #   cost any tokens. A request that gives up waiting for the identical
+    #   one (which may be waiting for retries) is sent on its own.
+    async def _post_chat(self, chat_context):
+        if not self.flights:
+            return await self._send_chat(chat_context)
+        try:
+            resp_dict, shared = await self.flights.do(flight_key(chat_context),
+                                                      lambda: self._send_chat(chat_context))
+        except FlightTimeout:
+            resp_dict, shared = await self._send_chat(chat_context), False
+        if shared:
+            resp_dict['usage'] = {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+            resp_dict['coalesced'] = True
+        return resp_dict
+
+    #
+    #   Send the request through the scheduler when there is one. Only a
+    #   request that is really sent takes one of the max_concurrency places,
+    #   so sessions waiting for an identical request don't hold one.
+    async def _send_chat(self, chat_context):
+        send = lambda: self._send_once(chat_context)
+        async with self._semaphore:
+            if not self.scheduler:
+                return await send()
+            estimate = estimate_message_tokens(chat_context['messages'])
+            estimate += chat_context.get('max_tokens') or 0
+            return await self.scheduler.run_async(send, estimate)
+
+    #
+    #   Send the request once. Errors are raised as a ChatRequestError, the
+    #   same as ChatClient does, so the scheduler can retry them.
+    async def _send_once(self, chat_context):
+        if not self._http:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._client.post_chat, chat_context)
+        payload = encode_chat_body(chat_context)
+        try:
+            async with self._http.post(self.service_url, data=payload) as response:
+                body = await response.read()
+                try:
+                    resp_dict = json.loads(body)
+                except ValueError:
+                    raise ChatRequestError("The response is not JSON", response.status,
+                                           response.headers, body.decode("utf-8", "replace"))
+                if response.status != 200 or not isinstance(resp_dict, dict) \
+                        or not resp_dict.get('choices'):
+                    raise _response_error(response, resp_dict if isinstance(resp_dict, dict) else {})
+                return resp_dict
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            raise ChatRequestError(f"Could not reach {self.service_url}: {err}")
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+#
+#   FILE: atomic_file.py
+#   CREATION DATE: October, 2026
+#
+#   Write files so that other processes never see half of a file.
+#
+#   The data is written to a temporary file in the same folder, and then the
+#   temporary file is renamed over the real one. A rename within one folder
+#   is atomic, so readers see either the old file or the new file.
+#
+
+import os, json, tempfile
+
+
+def write_bytes_atomic(path, data):
+    folder = os.path.dirname(path) or "."
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def write_json_atomic(path, obj):
+    write_bytes_atomic(path, json.dumps(obj, default=str).encode("utf-8"))
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+#
+#   FILE: background.py
+#   CREATION DATE: October, 2026
+#
+#   Work that runs in the background and must not keep the program alive.
+#
+#   Python waits for the worker threads of every ThreadPoolExecutor before
+#   it exits, even after shutdown(wait=False). When the user quits before
+#   the release list has been collected, the prototype sat there until the
+#   whole scrape of The Numbers was done. run_in_background() runs a
+#   function in a daemon thread instead, and returns a Future like submit()
+#   does, so nothing waits for it at exit.
+#
+
+import threading
+from concurrent.futures import Future
+
+
+#
+#   Call fn(*args, **kwargs) in a daemon thread and return a Future for its
+#   result. A thread that is still running when the program exits is stopped.
+def run_in_background(fn, *args, name=None, **kwargs):
+    future = Future()
+
+    def worker():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as err:
+            future.set_exception(err)
+        else:
+            future.set_result(result)
+
+    threading.Thread(target=worker, name=name, daemon=True).start()
+    return future
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+#
+#   FILE: batch.py
+#   CREATION DATE: October, 2026
+#
+#   Answers a file of questions without the interactive chat loop.
+#
+#   For QA, and to prepare recommendations ahead of time, we run hundreds of
+#   canned questions against the current release list. Batch mode reads the
+#   questions from a JSON lines file, sends them through a bounded pool of
+#   worker threads, and writes each answer to a JSON lines file as soon as it
+#   is ready, either in the order of the questions or in the order they
+#   finish. The shared client and scheduler (see scheduler.py) keep the
+#   workers within the rate limits of the key.
+#
+#   Running the same command again after an interruption skips every
+#   question that already has an answer in the output file.
+#
+#   Each line of the question file is either a JSON string, or an object
+#   with a "question" and an optional "id". Questions without an id are
+#   numbered by their line, so the numbering stays the same between runs.
+#
+
+import os, json, time, argparse, threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+#   CONSTANTS
+#
+DEFAULT_WORKERS = 8
+#
+#   At most this many questions per worker are waiting for a free worker,
+#   so a large file is not read into the pool all at once
+QUEUED_PER_WORKER = 2
+
+
+#
+#   A metrics sink (see metrics.py) that remembers the last turn record of
+#   each thread, so a worker can find the usage of the request it just made
+class TurnCollector(object):
+    def __init__(self):
+        self._local = threading.local()
+
+    def record(self, turn):
+        self._local.turn = turn
+
+    def start(self):
+        self._local.turn = None
+
+    def last_turn(self):
+        return getattr(self._local, 'turn', None)
+
+
+#
+#   Read the questions from a JSON lines file
+def read_queries(path):
+    queries = list()
+    with open(path, "r", encoding="utf-8") as query_file:
+        for line_number, line in enumerate(query_file, 1):
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if isinstance(entry, str):
+                entry = {'question': entry}
+            query = dict()
+            query['id'] = entry.get('id', line_number)
+            query['question'] = entry['question']
+            queries.append(query)
+    return queries
+
+#
+#   The ids of the questions that already have an answer in the output file
+def answered_ids(path):
+    answered = set()
+    try:
+        with open(path, "r", encoding="utf-8") as answer_file:
+            for line in answer_file:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    #   The last line may have been cut off by the interruption
+                    continue
+                if 'answer' in result:
+                    answered.add(result['id'])
+    except FileNotFoundError:
+        pass
+    return answered
+
+
+#
+#   Answer every question with answer(question_text) and write the results
+#   to output_path. Returns a report dictionary.
+def run_batch(answer, queries, output_path, workers=DEFAULT_WORKERS, ordered=True,
+              resume=True, metrics=None):
+    collector = TurnCollector()
+    if metrics is not None:
+        metrics.add_sink(collector)
+    skip = answered_ids(output_path) if resume else set()
+    todo = [query for query in queries if query['id'] not in skip]
+
+    report = dict()
+    report['queries'] = len(queries)
+    report['skipped'] = len(queries) - len(todo)
+    report['answered'] = 0
+    report['failed'] = 0
+    report['prompt_tokens'] = 0
+    report['completion_tokens'] = 0
+    report['total_tokens'] = 0
+    report['interrupted'] = False
+
+    def work(query):
+        result = dict()
+        result['id'] = query['id']
+        result['question'] = query['question']
+        collector.start()
+        start = time.perf_counter()
+        try:
+            result['answer'] = answer(query['question'])
+        except Exception as err:
+            result['error'] = str(err)
+        result['latency_s'] = round(time.perf_counter() - start, 4)
+        turn = collector.last_turn()
+        if turn is not None:
+            for field in ('prompt_tokens', 'completion_tokens', 'total_tokens', 'cache', 'retries'):
+                result[field] = turn[field]
+        return result
+
+    def write(result):
+        output_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+        output_file.flush()
+        if 'answer' in result:
+            report['answered'] += 1
+        else:
+            report['failed'] += 1
+        for field in ('prompt_tokens', 'completion_tokens', 'total_tokens'):
+            report[field] += result.get(field, 0)
+
+    start = time.perf_counter()
+    output_file = _open_output(output_path, resume)
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch")
+    window = workers * QUEUED_PER_WORKER
+    try:
+        if ordered:
+            pending = deque()
+            for query in todo:
+                pending.append(pool.submit(work, query))
+                while pending and (pending[0].done() or len(pending) >= window):
+                    write(pending.popleft().result())
+            while pending:
+                write(pending.popleft().result())
+        else:
+            pending = set()
+            for query in todo:
+                pending.add(pool.submit(work, query))
+                if len(pending) >= window:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        write(future.result())
+            for future in wait(pending).done:
+                write(future.result())
+    except KeyboardInterrupt:
+        #   Everything written so far is kept for the next run
+        report['interrupted'] = True
+        pool.shutdown(wait=False, cancel_futures=True)
+    finally:
+        pool.shutdown(wait=not report['interrupted'])
+        output_file.close()
+    report['elapsed_s'] = time.perf_counter() - start
+    done_count = report['answered'] + report['failed']
+    report['per_second'] = (done_count / report['elapsed_s']) if report['elapsed_s'] else 0.0
+    return report
+
+def _open_output(path, resume):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if not resume:
+        return open(path, "w", encoding="utf-8")
+    #   Don't append to a line that was cut off
+    cut_off = False
+    try:
+        with open(path, "rb") as existing:
+            existing.seek(0, os.SEEK_END)
+            if existing.tell() > 0:
+                existing.seek(-1, os.SEEK_END)
+                cut_off = existing.read(1) != b"\n"
+    except FileNotFoundError:
+        pass
+    output_file = open(path, "a", encoding="utf-8")
+    if cut_off:
+        output_file.write("\n")
+    return output_file
+
+#
+#   Print a report in the same style as the end of an interactive session
+def print_report(report):
+    print()
+    if report['interrupted']:
+        print("Interrupted - run the same command again to answer the remaining questions.")
+    print(f"Answered {report['answered']} of {report['queries']} questions "
+          f"({report['skipped']} already answered, {report['failed']} failed) "
+          f"in {report['elapsed_s']:.1f} seconds, {report['per_second']:.2f} per second.")
+    print(f"\n🔢 Total token usage in this batch: {report['total_tokens']} tokens "
+          f"({report['prompt_tokens']} prompt, {report['completion_tokens']} completion).\n")
+
+
+#
+#   The command line of batch mode, shared by all of the prototypes:
+#       python recommender_1.1.py --batch questions.jsonl answers.jsonl
+def main(argv, answer, metrics=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Answer a file of questions.")
+    parser.add_argument("questions", help="JSON lines file of questions")
+    parser.add_argument("answers", help="JSON lines file the answers are added to")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="questions answered at the same time")
+    parser.add_argument("--unordered", action="store_true",
+                        help="write answers as they finish, not in question order")
+    parser.add_argument("--restart", action="store_true",
+                        help="replace the answers file instead of resuming")
+    args = parser.parse_args(argv)
+
+    queries = read_queries(args.questions)
+    report = run_batch(answer, queries, args.answers, workers=args.workers,
+                       ordered=not args.unordered, resume=not args.restart, metrics=metrics)
+    print_report(report)
+    return report
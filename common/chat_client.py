@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+#
+#   FILE: chat_client.py
+#   CREATION DATE: October, 2026
+#
+#   A chat client shared by all of the recommender prototypes.
+#
+#   The prototypes used to call requests.post() for every chat turn. Each of
+#   those calls opens a brand new connection (TCP and TLS) to the service and
+#   rebuilds the request headers and service URL. A ChatClient owns a single
+#   requests.Session with a pool of keep-alive connections, so only the first
+#   turn pays for the connection set up.
+#
+#   A client can also be given a ResponseCache (see response_cache.py), so
+#   that a request it has already answered is not sent to the service again,
+#   and a RequestScheduler (see scheduler.py) that retries failed requests
+#   and keeps requests within the rate limits of the key. Every request can
+#   be measured with an Instrumentation (see metrics.py).
+#
+#   Identical requests made at the same time by several threads are sent
+#   only once (see single_flight.py): the first one goes to the service and
+#   the others share its response, so a burst of the same opening question
+#   costs one request against the rate limits instead of many.
+#
+#   requests takes longer to import than everything else a prototype
+#   needs to start, so it is only imported when the first client is made.
+#
+
+import json, time, threading, warnings
+
+from common.response_cache import cache_key
+from common.chat_message import encode_chat_body
+from common.context_window import estimate_message_tokens
+from common.metrics import new_turn_record
+from common.single_flight import SingleFlight, FlightTimeout, flight_key
+
+#   CONSTANTS
+#
+OAI_HOST = "https://api.openai.com"
+OAI_SERVICE_ENDPOINT = "/v1/chat/completions"
+#
+#   The pool size is the number of connections kept open to the service.
+#   It should be at least the number of threads that share one client.
+DEFAULT_POOL_SIZE = 10
+#
+#   Seconds to wait for the connection, and then for the response
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 60.0
+
+
+#
+#   Raised when a request fails. status is the HTTP status code, or None
+#   when there was no response at all (for example a connection error).
+class ChatRequestError(Exception):
+    def __init__(self, message="", status=None, headers=None, body=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+        self.body = body
+
+
+#
+#   A ChatClient sends a chat_context to the chat completions service
+#   and returns the decoded JSON response.
+class ChatClient(object):
+    def __init__(self, api_key="", host=OAI_HOST, endpoint=OAI_SERVICE_ENDPOINT,
+                 pool_size=DEFAULT_POOL_SIZE,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT,
+                 cache=None, scheduler=None, metrics=None, coalesce=True):
+        #   The service URL is the host and the service endpoint
+        self.service_url = host + endpoint
+        self.timeout = (connect_timeout, read_timeout)
+        import requests
+        from requests.adapters import HTTPAdapter
+        #
+        #   The session keeps connections alive between requests. The
+        #   adapter controls how many connections are kept in the pool.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        #
+        #   The headers are the same for every request, so they are set
+        #   once on the session - this must include the 'Content-Type' and
+        #   the 'Authorization' key set to include your API key
+        self.session.headers['Content-Type'] = "application/json"
+        self.session.headers['Authorization'] = f"Bearer {api_key}"
+        #
+        #   An optional ResponseCache, RequestScheduler, and Instrumentation
+        #   that is given a turn record for every request
+        self.cache = cache
+        self.scheduler = scheduler
+        self.metrics = metrics
+        #
+        #   Requests identical to one already in flight wait for its
+        #   response, at most as long as one try of the request could take
+        self.flights = SingleFlight(connect_timeout + read_timeout) if coalesce else None
+
+    #
+    #   Make a POST request with the whole context as the request body.
+    #   turn is an optional turn record (see metrics.py) for this request.
+    def post_chat(self, chat_context, turn=None):
+        return self._request(chat_context, turn)
+
+    #
+    #   Make the same request, but ask the service to stream the response
+    #   back as server-sent events. Each piece of text is passed to on_delta
+    #   as soon as it arrives. When the stream ends the pieces are put back
+    #   together, and the result has the same shape as the post_chat() result
+    def stream_chat(self, chat_context, on_delta=None, turn=None):
+        return self._request(chat_context, turn, stream=True, on_delta=on_delta)
+
+    #
+    #   The steps shared by post_chat() and stream_chat(): check the cache,
+    #   share the request with an identical one in flight, serialize the
+    #   request once, send it through the scheduler, and record how it went
+    def _request(self, chat_context, turn=None, stream=False, on_delta=None):
+        if turn is None:
+            turn = new_turn_record()
+        turn['stream'] = stream
+        try:
+            key = self._cache_key(chat_context)
+            if key:
+                resp_dict = self._cached_response(key)
+                if resp_dict:
+                    turn['cache'] = "hit"
+                    #   A cached response arrives all at once
+                    content = resp_dict['choices'][0]['message'].get('content')
+                    if stream and on_delta and content:
+                        on_delta(content)
+                    return resp_dict
+                turn['cache'] = "miss"
+
+            if self.flights:
+                resp_dict, shared = self._coalesce(chat_context, key, turn, stream, on_delta)
+            else:
+                resp_dict = self._send_chat(chat_context, key, turn, stream, on_delta)
+                shared = False
+            if shared:
+                #   Only the first of the identical requests cost tokens
+                turn['coalesced'] = True
+                resp_dict['usage'] = {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+                resp_dict['coalesced'] = True
+                content = resp_dict['choices'][0]['message'].get('content')
+                if stream and on_delta and content:
+                    on_delta(content)
+            usage = resp_dict.get('usage') or {}
+            turn['prompt_tokens'] = usage.get('prompt_tokens', 0)
+            turn['completion_tokens'] = usage.get('completion_tokens', 0)
+            turn['total_tokens'] = usage.get('total_tokens', 0)
+            return resp_dict
+        except ChatRequestError as err:
+            turn['outcome'] = "error"
+            turn['status'] = err.status
+            raise
+        finally:
+            if self.metrics:
+                self.metrics.emit(turn)
+
+    #
+    #   Send a request identical to one in flight only once. A request that
+    #   waits for another gets the response all at once, like a cache hit,
+    #   and the same error when the other one fails. The other request can
+    #   take much longer than one try while the scheduler retries it, so a
+    #   request that gives up waiting is sent on its own, through the
+    #   scheduler, instead of failing.
+    def _coalesce(self, chat_context, key, turn, stream, on_delta):
+        send = lambda: self._send_chat(chat_context, key, turn, stream, on_delta)
+        try:
+            return self.flights.do(flight_key(chat_context), send)
+        except FlightTimeout:
+            return send(), False
+
+    #
+    #   Serialize and send the request, and cache the response before any
+    #   request waiting for it is let go
+    def _send_chat(self, chat_context, key, turn, stream=False, on_delta=None):
+        start = time.perf_counter()
+        if stream:
+            #   Without stream_options the streamed response does not report token usage
+            payload = encode_chat_body(chat_context, stream=True,
+                                       stream_options={'include_usage': True})
+        else:
+            payload = encode_chat_body(chat_context)
+        turn['serialize_s'] = time.perf_counter() - start
+        turn['payload_bytes'] = len(payload)
+
+        if stream:
+            send = lambda: self._stream_chat(payload, turn, on_delta)
+        else:
+            send = lambda: self._post_chat(payload, turn)
+        resp_dict = self._schedule(send, chat_context, turn)
+        if key and resp_dict['choices'][0]['message'].get('content'):
+            self.cache.put(key, resp_dict)
+        return resp_dict
+
+    def _post_chat(self, payload, turn):
+        start = time.perf_counter()
+        response = self._send(payload)
+        turn['network_s'] = time.perf_counter() - start
+        #   The response should be 'application/json' so extract the JSON
+        start = time.perf_counter()
+        try:
+            resp_dict = response.json()
+        except ValueError:
+            raise ChatRequestError("The response is not JSON", response.status_code,
+                                   response.headers, response.text)
+        finally:
+            turn['parse_s'] = time.perf_counter() - start
+        if response.status_code != 200 or not resp_dict.get('choices'):
+            raise _response_error(response, resp_dict)
+        return resp_dict
+
+    #
+    #   For a streamed response the network time runs until the end of
+    #   the stream, and first_token_s is the time to the first text.
+    #   A stream that breaks off is a ChatRequestError. It is only retried
+    #   when no text was shown yet, so no text is shown twice.
+    def _stream_chat(self, payload, turn, on_delta=None):
+        import requests
+        start = time.perf_counter()
+        response = self._send(payload, stream=True)
+        if response.status_code != 200:
+            try:
+                resp_dict = response.json()
+            except ValueError:
+                resp_dict = dict()
+            response.close()
+            raise _response_error(response, resp_dict)
+        response.encoding = "utf-8"
+        role = "assistant"
+        pieces = list()
+        usage = dict()
+        try:
+            for chunk in iter_sse_events(response.iter_lines(decode_unicode=True)):
+                for choice in chunk.get('choices') or []:
+                    delta = choice.get('delta') or {}
+                    role = delta.get('role') or role
+                    text = delta.get('content')
+                    if text:
+                        if not pieces:
+                            turn['first_token_s'] = time.perf_counter() - start
+                        pieces.append(text)
+                        if on_delta:
+                            on_delta(text)
+                if chunk.get('usage'):
+                    usage = chunk['usage']
+        except (requests.RequestException, ChatRequestError) as err:
+            status = response.status_code if pieces else None
+            body = err.body if isinstance(err, ChatRequestError) else None
+            if not isinstance(err, ChatRequestError):
+                err = f"The response stream broke off: {err}"
+            raise ChatRequestError(str(err), status, response.headers, body)
+        finally:
+            response.close()
+            turn['network_s'] = time.perf_counter() - start
+        message = {'role': role, 'content': "".join(pieces)}
+        return {'choices': [{'message': message}], 'usage': usage}
+
+    #
+    #   Send the request body. Any failure of requests (no connection, a
+    #   timeout, a body that was cut off, ...) is turned into a
+    #   ChatRequestError, so it can be retried.
+    def _send(self, payload, stream=False):
+        import requests
+        try:
+            return self.session.post(self.service_url,
+                                     data=payload,
+                                     timeout=self.timeout,
+                                     stream=stream)
+        except requests.RequestException as err:
+            raise ChatRequestError(f"Could not reach {self.service_url}: {err}")
+
+    #
+    #   Run a request through the scheduler when there is one. Once a
+    #   streamed response has started it is not retried.
+    def _schedule(self, send, chat_context, turn):
+        if not self.scheduler:
+            return send()
+        estimate = estimate_message_tokens(chat_context['messages'])
+        estimate += chat_context.get('max_tokens') or 0
+        return self.scheduler.run(send, estimate, turn)
+
+    def _cache_key(self, chat_context):
+        if self.cache and self.cache.cacheable(chat_context):
+            return cache_key(chat_context)
+        return None
+
+    #
+    #   A cached response did not cost any tokens this time
+    def _cached_response(self, key):
+        resp_dict = self.cache.get(key)
+        if resp_dict is None:
+            return None
+        resp_dict['usage'] = {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+        resp_dict['cached'] = True
+        return resp_dict
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+#
+#   Make a ChatRequestError from an error response. The response can be a
+#   requests or an aiohttp response (which calls the status code 'status').
+def _response_error(response, resp_dict):
+    status = getattr(response, 'status_code', None) or getattr(response, 'status', None)
+    error = resp_dict.get('error') or {}
+    message = error.get('message') if isinstance(error, dict) else str(error)
+    message = message or f"The chat service answered with status {status}"
+    return ChatRequestError(message, status, response.headers, resp_dict)
+
+
+#
+#   Parse server-sent events from an iterator of text lines. Each event is
+#   one or more 'data:' lines followed by a blank line. The data of every
+#   event is JSON, except for the final '[DONE]' marker which ends the stream.
+#   Data that is not JSON raises a ChatRequestError.
+def iter_sse_events(lines):
+    data_lines = list()
+    for line in lines:
+        if line:
+            #   Lines starting with ':' are comments, other fields are ignored
+            if line.startswith("data:"):
+                data_lines.append(line[5:].lstrip(" "))
+            continue
+        if not data_lines:
+            continue
+        data = "\n".join(data_lines)
+        data_lines = list()
+        if data == "[DONE]":
+            return
+        yield _decode_event(data)
+    #   The stream may end without a final blank line
+    if data_lines:
+        data = "\n".join(data_lines)
+        if data != "[DONE]":
+            yield _decode_event(data)
+
+def _decode_event(data):
+    try:
+        return json.loads(data)
+    except ValueError:
+        raise ChatRequestError("A response event is not JSON", body=data)
+
+
+#
+#   Most of the time a program only needs one client per key and service.
+#   This returns the same ChatClient every time it is called with the same
+#   key, host and endpoint so that all turns share one connection pool.
+#   The other arguments are only used when the client is made, so a call
+#   with different ones gets a warning instead of being silently ignored.
+_shared_clients = dict()
+_shared_clients_kwargs = dict()
+_shared_clients_lock = threading.Lock()
+
+def get_shared_client(api_key="", host=OAI_HOST, endpoint=OAI_SERVICE_ENDPOINT, **kwargs):
+    client_key = (api_key, host, endpoint)
+    with _shared_clients_lock:
+        client = _shared_clients.get(client_key)
+        if client is None:
+            client = ChatClient(api_key, host, endpoint, **kwargs)
+            _shared_clients[client_key] = client
+            _shared_clients_kwargs[client_key] = kwargs
+            return client
+        made_with = _shared_clients_kwargs[client_key]
+    changed = [name for name, value in kwargs.items()
+               if _differs(made_with.get(name, _default_argument(name)), value)]
+    if changed:
+        warnings.warn(f"The shared client for {host} already exists, so these arguments are "
+                      f"ignored: {', '.join(sorted(changed))}", RuntimeWarning, stacklevel=2)
+    return client
+
+def _default_argument(name):
+    import inspect
+    parameter = inspect.signature(ChatClient).parameters.get(name)
+    return parameter.default if parameter is not None else None
+
+#   Objects like a cache or a scheduler must be the same object; numbers
+#   and flags only need to be equal
+def _differs(old, new):
+    if old is new:
+        return False
+    if isinstance(new, (bool, int, float, str, tuple)) or new is None:
+        return old != new
+    return True
+
+#
+#   Close all of the shared clients, for example when a program exits
+def close_shared_clients():
+    with _shared_clients_lock:
+        for client in _shared_clients.values():
+            client.close()
+        _shared_clients.clear()
+        _shared_clients_kwargs.clear()
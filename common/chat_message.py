@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+#
+#   FILE: chat_message.py
+#   CREATION DATE: October, 2026
+#
+#   Compact chat turns and contexts that remember their own JSON.
+#
+#   Every turn used to be a fresh dict, and every request ran json.dumps over
+#   the whole chat_context, so the same unchanged turns were encoded again on
+#   every turn. A ChatMessage keeps its role and content in __slots__ (no
+#   per-object dict) and remembers its encoded JSON the first time it is
+#   needed. encode_chat_body() then builds the request body by joining the
+#   remembered pieces, so each turn only pays to encode what is new.
+#
+#   Both types can be used like the dictionaries they replace:
+#   chat_context['messages'][-1]['content'] still works, and a ChatContext
+#   turns plain dict messages (like the one in a response) into ChatMessages
+#   as they are added.
+#
+#   JSON is written with sorted keys, no spaces and UTF-8 text, which is the
+#   same form response_cache.cache_key() hashes, so the same pieces are used
+#   for the request body, the cache key and the session log.
+#
+
+import json
+from collections.abc import Mapping
+
+#   CONSTANTS
+#
+#   The keys every message has
+MESSAGE_KEYS = ('role', 'content')
+
+_encoder = json.JSONEncoder(sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+
+#
+#   The JSON for any value, as UTF-8 bytes
+def encode_value(value):
+    return _encoder.encode(value).encode("utf-8")
+
+#
+#   The JSON for one message, remembered when it is a ChatMessage
+def encode_message(message):
+    if isinstance(message, ChatMessage):
+        return message.fragment()
+    return encode_value(message)
+
+#
+#   The JSON for a list of messages
+def encode_messages(messages):
+    return b"[" + b",".join([encode_message(message) for message in messages]) + b"]"
+
+#
+#   The JSON for a chat_context (a ChatContext or a plain dictionary).
+#   With fields only those keys are written, and missing ones are written as
+#   null; otherwise every key is written. Keyword arguments are added to
+#   the body, like stream=True.
+def encode_chat_body(chat_context, fields=None, **extra):
+    names = set(chat_context.keys() if fields is None else fields)
+    names.update(extra)
+    parts = list()
+    for name in sorted(names):
+        value = extra[name] if name in extra else chat_context.get(name)
+        if name == 'messages' and value is not None:
+            encoded = encode_messages(value)
+        else:
+            encoded = encode_value(value)
+        parts.append(encode_value(name) + b":" + encoded)
+    return b"{" + b",".join(parts) + b"}"
+
+
+#
+#   One chat turn. Keys other than 'role' and 'content' (like 'refusal' in
+#   a response) are kept in a small dictionary, which most turns don't need.
+class ChatMessage(Mapping):
+    __slots__ = ('role', 'content', 'extra', '_fragment')
+
+    def __init__(self, role="", content="", **extra):
+        self.role = role
+        self.content = content
+        self.extra = extra or None
+        self._fragment = None
+
+    @classmethod
+    def from_dict(cls, message):
+        if isinstance(message, cls):
+            return message
+        message = dict(message)
+        return cls(message.pop('role', ""), message.pop('content', ""), **message)
+
+    #
+    #   The JSON for this message, encoded only once
+    def fragment(self):
+        if self._fragment is None:
+            self._fragment = encode_value(self.to_dict())
+        return self._fragment
+
+    def to_dict(self):
+        message = dict()
+        message['role'] = self.role
+        message['content'] = self.content
+        if self.extra:
+            message.update(self.extra)
+        return message
+
+    def __getitem__(self, key):
+        if key == 'role':
+            return self.role
+        if key == 'content':
+            return self.content
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in MESSAGE_KEYS:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = dict()
+            self.extra[key] = value
+        self._fragment = None
+
+    def __iter__(self):
+        yield 'role'
+        yield 'content'
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self):
+        return len(MESSAGE_KEYS) + (len(self.extra) if self.extra else 0)
+
+    def __repr__(self):
+        return f"ChatMessage({self.to_dict()!r})"
+
+
+#
+#   A list of ChatMessages. Plain dictionaries are turned into ChatMessages
+#   when they are added, so their JSON can be remembered too.
+class MessageList(list):
+    __slots__ = ()
+
+    def __init__(self, messages=()):
+        super().__init__(ChatMessage.from_dict(message) for message in messages)
+
+    def append(self, message):
+        super().append(ChatMessage.from_dict(message))
+
+    def insert(self, position, message):
+        super().insert(position, ChatMessage.from_dict(message))
+
+    def extend(self, messages):
+        super().extend(ChatMessage.from_dict(message) for message in messages)
+
+    def __setitem__(self, position, value):
+        if isinstance(position, slice):
+            value = [ChatMessage.from_dict(message) for message in value]
+        else:
+            value = ChatMessage.from_dict(value)
+        super().__setitem__(position, value)
+
+
+#
+#   A chat_context: the request settings (model, temperature, ...) and the
+#   messages. Setting 'messages' to a list makes it a MessageList.
+class ChatContext(Mapping):
+    __slots__ = ('settings', '_messages')
+
+    def __init__(self, messages=(), **settings):
+        self.settings = settings
+        self._messages = MessageList(messages)
+
+    @classmethod
+    def from_dict(cls, chat_context):
+        if isinstance(chat_context, cls):
+            return chat_context
+        settings = dict(chat_context)
+        return cls(settings.pop('messages', ()), **settings)
+
+    #
+    #   A new context with the same settings and messages. The messages
+    #   themselves are shared, so their JSON is not encoded again.
+    def copy(self):
+        return ChatContext(self._messages, **self.settings)
+
+    def to_dict(self):
+        chat_context = dict(self.settings)
+        chat_context['messages'] = [message.to_dict() for message in self._messages]
+        return chat_context
+
+    def __getitem__(self, key):
+        if key == 'messages':
+            return self._messages
+        return self.settings[key]
+
+    def __setitem__(self, key, value):
+        if key == 'messages':
+            self._messages = value if isinstance(value, MessageList) else MessageList(value)
+        else:
+            self.settings[key] = value
+
+    def __delitem__(self, key):
+        if key == 'messages':
+            self._messages = MessageList()
+        else:
+            del self.settings[key]
+
+    def __iter__(self):
+        yield from self.settings
+        yield 'messages'
+
+    def __len__(self):
+        return len(self.settings) + 1
+
+    def __repr__(self):
+        return f"ChatContext({self.to_dict()!r})"
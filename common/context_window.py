@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+#   FILE: context_window.py
+#   CREATION DATE: October, 2026
+#
+#   Keeps a chat_context under a token budget.
+#
+#   Every turn adds to chat_context['messages'] and the whole history is sent
+#   with every request, so the request gets bigger (and more expensive) every
+#   turn. A ContextWindow keeps the system turn pinned and drops the oldest
+#   turns until the estimated size of the messages fits in the budget. The
+#   estimate is done locally so it does not need another call to the service.
+#
+
+import re, functools
+
+#   CONSTANTS
+#
+DEFAULT_TOKEN_BUDGET = 3000
+#
+#   Every message costs a few tokens on top of its content for the role
+#   and separators, and the reply is primed with a few more
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+#
+#   English text averages about four characters per token. Text with lots
+#   of short words and punctuation uses more, so words are counted too.
+CHARS_PER_TOKEN = 4
+_WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+#
+#   Estimate the number of tokens in a piece of text. The same text (like
+#   the system prompt) is estimated every turn, so results are remembered.
+@functools.lru_cache(maxsize=4096)
+def estimate_tokens(text=""):
+    if not text:
+        return 0
+    return max(len(text) // CHARS_PER_TOKEN, len(_WORD_PATTERN.findall(text)))
+
+#
+#   Estimate the number of prompt tokens for a list of messages
+def estimate_message_tokens(messages=[]):
+    total = TOKENS_PER_REPLY
+    for message in messages:
+        total += TOKENS_PER_MESSAGE + estimate_tokens(message.get('content') or "")
+    return total
+
+
+#
+#   A ContextWindow trims the messages of a chat_context so that the
+#   prompt plus the response (max_tokens) fits within token_budget.
+#   The most recent min_recent_turns messages are never dropped.
+#
+#   keep(message) can say which other messages must never be dropped, and
+#   on_drop(chat_context, dropped) is told which messages were dropped (see
+#   TieredMemory.attach() in memory.py).
+class ContextWindow(object):
+    def __init__(self, token_budget=DEFAULT_TOKEN_BUDGET, min_recent_turns=1,
+                 keep=None, on_drop=None):
+        self.token_budget = token_budget
+        self.min_recent_turns = min_recent_turns
+        self.keep = keep
+        self.on_drop = on_drop
+        #   Running totals, so a program can report what trimming saved
+        self.trim_count = 0
+        self.tokens_saved = 0
+        self.last_report = None
+
+    #
+    #   Trim the chat_context in place. Returns a report dictionary when
+    #   turns were dropped, or None when the messages already fit.
+    def trim(self, chat_context):
+        messages = chat_context['messages']
+        #   Leading system turns are pinned and always kept
+        pinned = 0
+        while pinned < len(messages) and messages[pinned].get('role') == "system":
+            pinned += 1
+        budget = self.token_budget - (chat_context.get('max_tokens') or 0)
+
+        counts = [TOKENS_PER_MESSAGE + estimate_tokens(m.get('content') or "") for m in messages]
+        tokens_before = TOKENS_PER_REPLY + sum(counts)
+        if tokens_before <= budget:
+            return None
+
+        #   Drop the oldest turns until the rest fits
+        tokens_after = tokens_before
+        first_kept = pinned
+        last_droppable = len(messages) - self.min_recent_turns
+        while tokens_after > budget and first_kept < last_droppable:
+            tokens_after -= counts[first_kept]
+            first_kept += 1
+        #   Don't leave an assistant turn without the user turn it answered
+        while first_kept < last_droppable and messages[first_kept].get('role') == "assistant":
+            tokens_after -= counts[first_kept]
+            first_kept += 1
+        if first_kept == pinned:
+            return None
+
+        #   Turns that must be kept stay where they are
+        kept = list()
+        dropped = list()
+        for position in range(pinned, first_kept):
+            if self.keep and self.keep(messages[position]):
+                kept.append(messages[position])
+                tokens_after += counts[position]
+            else:
+                dropped.append(messages[position])
+        if not dropped:
+            return None
+
+        chat_context['messages'] = messages[:pinned] + kept + messages[first_kept:]
+        if self.on_drop:
+            self.on_drop(chat_context, dropped)
+        report = dict()
+        report['dropped_turns'] = len(dropped)
+        report['tokens_before'] = tokens_before
+        report['tokens_after'] = tokens_after
+        report['tokens_saved'] = tokens_before - tokens_after
+        self.trim_count += 1
+        self.tokens_saved += report['tokens_saved']
+        self.last_report = report
+        return report
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+#
+#   FILE: memory.py
+#   CREATION DATE: October, 2026
+#
+#   Tiered memory for long chats.
+#
+#   Trimming (see context_window.py) keeps the prompt under budget by dropping
+#   the oldest turns, which are often the ones where the user said what they
+#   like and what they can't stand. TieredMemory keeps three tiers instead:
+#
+#   - the most recent turns, word for word
+#   - a rolling summary of the older turns, in one system turn
+#   - a preference profile (genres, people and titles the user likes or
+#     dislikes), picked out of the user turns locally with a few patterns
+#
+#   Folding old turns into the summary happens in a background thread after
+#   the response has been shown, so it never delays an answer. Until a turn
+#   has been folded it stays in the messages word for word. The summary can
+#   be written by a cheap chat model (see chat_summarizer), or locally.
+#
+#   A ContextWindow (see context_window.py) can still drop a turn before it
+#   has been folded, when a long answer pushes the prompt over the budget.
+#   attach() makes the window hand such turns to the memory, which folds
+#   them in with the next refresh, and keeps the window from dropping the
+#   memory turn.
+#
+
+import re, threading
+
+from common.chat_message import ChatMessage
+from common.background import run_in_background
+from common.context_window import estimate_tokens
+from common.metrics import new_turn_record
+
+#   CONSTANTS
+#
+#   How many of the latest turns are always kept word for word
+DEFAULT_RECENT_TURNS = 6
+#
+#   The rough size of the summary, in tokens
+DEFAULT_SUMMARY_TOKENS = 300
+#
+#   How many likes and dislikes the profile remembers
+MAX_PREFERENCES = 12
+#
+GENRES = ("action", "adventure", "animated", "animation", "anime", "biopic", "classic",
+          "comedy", "comedies", "crime", "documentary", "drama", "family", "fantasy",
+          "foreign", "horror", "imax", "indie", "musical", "mystery", "romance",
+          "romantic", "sci-fi", "science fiction", "superhero", "thriller", "war", "western")
+#
+#   The instructions given to a chat model that writes the summary
+SUMMARY_PROMPT = '''You keep notes for a movie recommender. Update the summary of the conversation with the new turns. Keep what the user likes and dislikes, what they asked for, and which movies were already recommended. Answer with the summary only, in at most {words} words.'''
+
+_CLAUSE_SPLIT = re.compile(r"[.!?;,]+|\bbut\b", re.IGNORECASE)
+_NEGATIVE = re.compile(r"\b(?:don'?t|didn'?t|doesn'?t|do not|did not|never|not|no|hate|hated|"
+                       r"dislike|disliked|avoid|can'?t stand|tired of|sick of)\b", re.IGNORECASE)
+_POSITIVE = re.compile(r"\b(?:love|loved|like|liked|enjoy|enjoyed|favou?rite|fan of|into|want|"
+                       r"looking for|prefer|in the mood for)\b", re.IGNORECASE)
+_GENRE = re.compile(r"\b(?:" + "|".join(re.escape(genre) for genre in GENRES) + r")s?\b",
+                    re.IGNORECASE)
+#   A run of capitalized words after a verb of liking, like an actor or a title
+_NAMED = re.compile(r"\b(?:love|loved|like|liked|enjoy|enjoyed|fan of|hate|hated|dislike|"
+                    r"disliked|avoid|stand)\s+((?:[A-Z][\w'\-:]*\s?){1,4})")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+#
+#   The tastes of the user, picked out of what they type
+class PreferenceProfile(object):
+    def __init__(self, max_items=MAX_PREFERENCES):
+        self.max_items = max_items
+        #   Dictionaries keep the order things were said in; saying
+        #   something again moves it to the end
+        self.likes = dict()
+        self.dislikes = dict()
+
+    def update(self, text=""):
+        for clause in _CLAUSE_SPLIT.split(text or ""):
+            negative = bool(_NEGATIVE.search(clause))
+            positive = bool(_POSITIVE.search(clause))
+            if not (negative or positive):
+                continue
+            found = [match.group(0).lower() for match in _GENRE.finditer(clause)]
+            found += [match.group(1).strip() for match in _NAMED.finditer(clause)]
+            for item in found:
+                self._remember(item, negative)
+
+    def describe(self):
+        parts = list()
+        if self.likes:
+            parts.append("Likes: " + ", ".join(self.likes) + ".")
+        if self.dislikes:
+            parts.append("Dislikes: " + ", ".join(self.dislikes) + ".")
+        return " ".join(parts)
+
+    def _remember(self, item, negative):
+        keep, other = (self.dislikes, self.likes) if negative else (self.likes, self.dislikes)
+        other.pop(item, None)
+        keep.pop(item, None)
+        keep[item] = True
+        while len(keep) > self.max_items:
+            keep.pop(next(iter(keep)))
+
+
+#
+#   A summary made locally: a short line for every turn, keeping only the
+#   latest lines that fit in token_budget
+def extractive_summary(previous="", turns=[], token_budget=DEFAULT_SUMMARY_TOKENS):
+    lines = previous.splitlines() if previous else []
+    for turn in turns:
+        content = " ".join((turn.get('content') or "").split())
+        if turn.get('role') == "user":
+            lines.append("User: " + content[:200])
+        elif turn.get('role') == "assistant":
+            lines.append("Recommender: " + _SENTENCE_END.split(content, 1)[0][:200])
+    kept = list()
+    used = 0
+    for line in reversed(lines):
+        used += estimate_tokens(line)
+        if used > token_budget:
+            break
+        kept.append(line)
+    return "\n".join(reversed(kept))
+
+#
+#   A summarizer that asks a (cheap) chat model to write the summary.
+#   get_client is called when a summary is needed, so no client (and no
+#   network library) is made before that. The requests are marked as
+#   summaries in their turn records, and the tokens they used are counted
+#   in tokens_used.
+class ChatSummarizer(object):
+    def __init__(self, get_client, model, token_budget=DEFAULT_SUMMARY_TOKENS):
+        self.get_client = get_client
+        self.model = model
+        self.token_budget = token_budget
+        self.tokens_used = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, previous, turns):
+        transcript = "\n".join(f"{turn.get('role')}: {turn.get('content')}" for turn in turns)
+        chat_context = dict()
+        chat_context['model'] = self.model
+        chat_context['temperature'] = 0
+        chat_context['max_tokens'] = self.token_budget
+        chat_context['messages'] = [
+            {'role': "system", 'content': SUMMARY_PROMPT.format(words=self.token_budget * 3 // 4)},
+            {'role': "user", 'content': f"SUMMARY SO FAR:\n{previous or '(none)'}\n\nNEW TURNS:\n{transcript}"},
+        ]
+        resp_dict = self.get_client().post_chat(chat_context, new_turn_record(purpose="summary"))
+        usage = resp_dict.get('usage') or {}
+        with self._lock:
+            self.tokens_used += usage.get('total_tokens', 0)
+        return resp_dict['choices'][0]['message']['content'].strip()
+
+
+def chat_summarizer(get_client, model, token_budget=DEFAULT_SUMMARY_TOKENS):
+    return ChatSummarizer(get_client, model, token_budget)
+
+
+#
+#   TieredMemory manages the memory turn of one chat_context. Call
+#   observe() with each user turn, compact() before each request, and
+#   refresh_async() after each response has been shown.
+#
+#   summarize(previous_summary, turns) returns the new summary. When it is
+#   None, or when it fails, the summary is made locally.
+class TieredMemory(object):
+    def __init__(self, summarize=None, recent_turns=DEFAULT_RECENT_TURNS,
+                 summary_tokens=DEFAULT_SUMMARY_TOKENS):
+        self.summarize = summarize
+        self.recent_turns = recent_turns
+        self.summary_tokens = summary_tokens
+        self.profile = PreferenceProfile()
+        self.summary = ""
+        self.folded_turns = 0
+        self._memory_turn = None
+        #   Turns that are in the summary and can leave the messages, by id.
+        #   The turns are kept here until then, so their ids are not reused.
+        self._folded = dict()
+        #   Turns the context window dropped before they were folded, and
+        #   the ids of the turns a running refresh is folding
+        self._dropped = list()
+        self._folding = set()
+        self._chat_context = None
+        self._future = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def observe(self, user_text=""):
+        self.profile.update(user_text)
+
+    #
+    #   Rebuild the profile from earlier turns, for example of a resumed session
+    def observe_turns(self, messages=[]):
+        for message in messages:
+            if message.get('role') == "user":
+                self.profile.update(message.get('content'))
+
+    #
+    #   Make a ContextWindow keep the memory turn, and hand the turns it drops
+    #   to the memory
+    def attach(self, context_window):
+        context_window.keep = self.needs
+        context_window.on_drop = self.dropped
+
+    #
+    #   Does the memory still need this message in the chat_context?
+    def needs(self, message):
+        return message is self._memory_turn
+
+    #
+    #   Remember turns the context window dropped from the chat_context this
+    #   memory manages, so they are folded into the summary with the next
+    #   refresh instead of being lost
+    def dropped(self, chat_context, messages):
+        if chat_context is not self._chat_context:
+            return
+        with self._lock:
+            known = set(id(turn) for turn in self._dropped)
+            for message in messages:
+                if message.get('role') == "system" or message is self._memory_turn:
+                    continue
+                if id(message) in self._folded or id(message) in self._folding:
+                    continue
+                if id(message) not in known:
+                    self._dropped.append(message)
+
+    #
+    #   Drop the turns that have been folded into the summary, and put the
+    #   memory turn (profile and summary) right after the leading system turns
+    def compact(self, chat_context):
+        self._chat_context = chat_context
+        with self._lock:
+            summary = self.summary
+            folded = self._folded
+            self._folded = dict()
+        messages = chat_context['messages']
+        head = list()
+        rest = list()
+        for message in messages:
+            if message is self._memory_turn:
+                continue
+            if not rest and message.get('role') == "system":
+                head.append(message)
+            elif id(message) not in folded:
+                rest.append(message)
+        memory_text = self._memory_text(summary)
+        if memory_text:
+            if self._memory_turn is None or self._memory_turn['content'] != memory_text:
+                self._memory_turn = ChatMessage("system", memory_text)
+            head.append(self._memory_turn)
+        chat_context['messages'] = head + rest
+
+    #
+    #   Fold the turns older than the recent ones into the summary, in the
+    #   background. Only one refresh runs at a time. The refresh runs in a
+    #   daemon thread, so quitting doesn't wait for the summary request.
+    def refresh_async(self, chat_context):
+        turns = [message for message in chat_context['messages']
+                 if message.get('role') != "system"]
+        old_turns = turns[:-self.recent_turns] if self.recent_turns else turns
+        #   Don't split a question from its answer
+        while old_turns and old_turns[-1].get('role') == "user":
+            old_turns.pop()
+        with self._lock:
+            if self._closed or (self._future is not None and not self._future.done()):
+                return None
+            #   Dropped turns are older than any still in the messages
+            old_turns = self._dropped + old_turns
+            self._dropped = list()
+            old_turns = [turn for turn in old_turns if id(turn) not in self._folded]
+            if not old_turns:
+                return None
+            self._folding = set(id(turn) for turn in old_turns)
+            self._future = run_in_background(self._fold, self.summary, old_turns, name="memory")
+            return self._future
+
+    #
+    #   Wait for a running refresh, for example before the program exits
+    def wait(self, timeout=None):
+        future = self._future
+        if future is not None:
+            future.exception(timeout)
+
+    #
+    #   Start no more refreshes. A running one is left to finish, or is
+    #   stopped when the program exits.
+    def close(self):
+        with self._lock:
+            self._closed = True
+
+    #
+    #   The tokens the summary requests have used so far. A local summary
+    #   costs nothing.
+    @property
+    def summary_tokens_used(self):
+        return getattr(self.summarize, 'tokens_used', 0)
+
+    def _fold(self, previous, turns):
+        summary = None
+        if self.summarize:
+            try:
+                summary = self.summarize(previous, turns)
+            except Exception:
+                summary = None
+        if not summary:
+            summary = extractive_summary(previous, turns, self.summary_tokens)
+        with self._lock:
+            self.summary = summary
+            self._folded.update((id(turn), turn) for turn in turns)
+            self._folding = set()
+            self.folded_turns += len(turns)
+        return summary
+
+    def _memory_text(self, summary):
+        parts = list()
+        preferences = self.profile.describe()
+        if preferences:
+            parts.append("What the user has told you about their tastes: " + preferences)
+        if summary:
+            parts.append("Summary of the earlier conversation:\n" + summary)
+        return "\n\n".join(parts)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+#
+#   FILE: metrics.py
+#   CREATION DATE: October, 2026
+#
+#   Per-turn measurements for the chat pipeline.
+#
+#   Every chat turn makes a turn record - a dictionary with how long each
+#   step took (building the prompt, json.dumps, the network, parsing the
+#   response), the token counts, the size of the request body and whether
+#   the response came from the cache, was shared or needed retries. Requests
+#   made for something other than a user turn, like a memory summary, say so
+#   in their 'purpose'. Records are passed to one or more sinks:
+#
+#   - JsonLinesSink writes every record as one line of JSON to a file
+#   - MetricsRegistry keeps counters and histograms in memory, and can
+#     write them out in the Prometheus text format
+#
+#   Anything with a record(turn) method can be used as a sink.
+#
+
+import json, time, threading, bisect
+
+#   CONSTANTS
+#
+#   Histogram buckets, in seconds and in bytes
+SECONDS_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+#
+#   The timing fields of a turn record
+TIMING_FIELDS = ('prompt_build_s', 'serialize_s', 'network_s', 'parse_s')
+
+
+#
+#   A new, empty turn record
+def new_turn_record(**fields):
+    turn = dict()
+    turn['time'] = time.time()
+    for field in TIMING_FIELDS:
+        turn[field] = 0.0
+    turn['prompt_tokens'] = 0
+    turn['completion_tokens'] = 0
+    turn['total_tokens'] = 0
+    turn['payload_bytes'] = 0
+    #   'hit', 'miss' or 'off' when there is no cache for the request
+    turn['cache'] = "off"
+    turn['retries'] = 0
+    #   True when the response was shared with an identical request that
+    #   was already in flight (see single_flight.py)
+    turn['coalesced'] = False
+    #   'ok' or 'error', and the HTTP status of a failed request
+    turn['outcome'] = "ok"
+    turn['status'] = None
+    turn['stream'] = False
+    #   'chat' for a user turn, or what else the request was made for, like
+    #   'summary' for the summary of the tiered memory (see memory.py)
+    turn['purpose'] = "chat"
+    turn.update(fields)
+    return turn
+
+
+#
+#   Instrumentation passes each finished turn record to every sink
+class Instrumentation(object):
+    def __init__(self, sinks=None):
+        self.sinks = list(sinks or [])
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def emit(self, turn):
+        for sink in self.sinks:
+            sink.record(turn)
+
+
+#
+#   Writes each turn record as a line of JSON
+class JsonLinesSink(object):
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def record(self, turn):
+        line = json.dumps(turn, default=str) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+#
+#   A histogram counts observations into buckets, like a Prometheus histogram
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+#
+#   Counters and histograms for all of the turns, kept in memory.
+#   Metrics are keyed by name and a tuple of (label, value) pairs.
+class MetricsRegistry(object):
+    def __init__(self):
+        self.counters = dict()
+        self.histograms = dict()
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = Histogram(buckets)
+                self.histograms[key] = histogram
+            histogram.observe(value)
+
+    #
+    #   Requests that were not user turns, like memory summaries, are counted
+    #   apart, so the turn and token counts are those of the chat itself
+    def record(self, turn):
+        purpose = turn.get('purpose', "chat")
+        if purpose != "chat":
+            self.inc("chat_background_requests_total", purpose=purpose, outcome=turn['outcome'])
+            self.inc("chat_background_tokens_total", turn['prompt_tokens'],
+                     purpose=purpose, kind="prompt")
+            self.inc("chat_background_tokens_total", turn['completion_tokens'],
+                     purpose=purpose, kind="completion")
+            return
+        self.inc("chat_turns_total", outcome=turn['outcome'])
+        self.inc("chat_cache_lookups_total", result=turn['cache'])
+        self.inc("chat_retries_total", turn['retries'])
+        if turn.get('coalesced'):
+            self.inc("chat_coalesced_total")
+        self.inc("chat_tokens_total", turn['prompt_tokens'], kind="prompt")
+        self.inc("chat_tokens_total", turn['completion_tokens'], kind="completion")
+        self.inc("chat_payload_bytes_total", turn['payload_bytes'])
+        self.observe("chat_payload_bytes", turn['payload_bytes'], BYTES_BUCKETS)
+        for field in TIMING_FIELDS:
+            self.observe("chat_turn_seconds", turn[field], phase=field[:-2])
+
+    #
+    #   The metrics in the Prometheus text exposition format
+    def to_prometheus(self):
+        lines = list()
+        with self._lock:
+            for name in sorted({key[0] for key in self.counters}):
+                lines.append(f"# TYPE {name} counter")
+                for (key_name, labels), value in sorted(self.counters.items()):
+                    if key_name == name:
+                        lines.append(f"{name}{_format_labels(labels)} {value}")
+            for name in sorted({key[0] for key in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (key_name, labels), histogram in sorted(self.histograms.items(),
+                                                            key=lambda item: item[0]):
+                    if key_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                        cumulative += count
+                        bucket_labels = labels + (("le", str(bound)),)
+                        lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def dump_prometheus(self, path):
+        with open(path, "w", encoding="utf-8") as dump_file:
+            dump_file.write(self.to_prometheus())
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+#
+#   FILE: mock_server.py
+#   CREATION DATE: October, 2026
+#
+#   A local stand-in for the /v1/chat/completions service.
+#
+#   The mock server answers chat requests without a key and without any
+#   cost, so the prototypes can be measured without the real OAI_HOST. It
+#   can wait before answering (latency), produce the answer at a set speed
+#   (tokens per second), stream the answer as server-sent events, and fail
+#   a share of the requests on purpose (error injection).
+#
+#   Run it from the top of the repository with
+#       python -m common.mock_server --port 8765 --latency 0.2
+#   and set OAI_HOST = "http://127.0.0.1:8765" in a prototype.
+#
+
+import sys, json, time, random, argparse, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from common.chat_client import OAI_SERVICE_ENDPOINT
+from common.context_window import estimate_message_tokens
+
+#   CONSTANTS
+#
+DEFAULT_PORT = 8765
+DEFAULT_LATENCY = 0.05
+DEFAULT_TOKENS_PER_SECOND = 0
+DEFAULT_COMPLETION_TOKENS = 60
+#
+#   The words used to make up responses
+REPLY_WORDS = ("You", "might", "enjoy", "a", "film", "with", "great", "visuals,",
+               "a", "moving", "score", "and", "a", "plot", "that", "keeps", "you",
+               "guessing", "until", "the", "very", "end.")
+
+
+#
+#   MockChatServer runs the server in a background thread. The settings
+#   can be changed while it is running.
+class MockChatServer(object):
+    def __init__(self, host="127.0.0.1", port=0, latency=DEFAULT_LATENCY,
+                 tokens_per_second=DEFAULT_TOKENS_PER_SECOND,
+                 completion_tokens=DEFAULT_COMPLETION_TOKENS,
+                 error_rate=0.0, error_status=500, retry_after=None, seed=None):
+        #   Seconds before the first byte of the response
+        self.latency = latency
+        #   How fast the answer is produced, 0 means all at once
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        #   The share of requests that fail, with this status code
+        self.error_rate = error_rate
+        self.error_status = error_status
+        #   The Retry-After header sent with failed requests, if any
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        #   Counters and the sizes of the request bodies received
+        self.request_count = 0
+        self.error_count = 0
+        self.request_bytes = list()
+        self._lock = threading.Lock()
+
+        handler = type("MockChatHandler", (_MockChatHandler,), {'mock': self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever,
+                                        name="mock-chat-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_counters(self):
+        with self._lock:
+            self.request_count = 0
+            self.error_count = 0
+            self.request_bytes = list()
+
+    def _record(self, body_size):
+        with self._lock:
+            self.request_count += 1
+            self.request_bytes.append(body_size)
+            failed = self.error_rate > 0 and self.random.random() < self.error_rate
+            if failed:
+                self.error_count += 1
+        return failed
+
+    def _reply_words(self):
+        count = self.completion_tokens
+        return [REPLY_WORDS[i % len(REPLY_WORDS)] for i in range(count)]
+
+
+class _MockChatHandler(BaseHTTPRequestHandler):
+    #   HTTP/1.1 keeps connections open, like the real service
+    protocol_version = "HTTP/1.1"
+    #   Headers and body are written separately, so don't let the
+    #   socket hold back small writes
+    disable_nagle_algorithm = True
+    mock = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.path != OAI_SERVICE_ENDPOINT:
+            return self._send_json(404, {'error': {'message': f"Unknown path {self.path}"}})
+        failed = self.mock._record(len(body))
+        try:
+            request = json.loads(body)
+        except ValueError:
+            return self._send_json(400, {'error': {'message': "Request body is not JSON"}})
+
+        time.sleep(self.mock.latency)
+        if failed:
+            headers = dict()
+            if self.mock.retry_after is not None:
+                headers['Retry-After'] = str(self.mock.retry_after)
+            error = {'message': "Injected error", 'type': "mock_error"}
+            return self._send_json(self.mock.error_status, {'error': error}, headers)
+
+        words = self.mock._reply_words()
+        usage = dict()
+        usage['prompt_tokens'] = estimate_message_tokens(request.get('messages') or [])
+        usage['completion_tokens'] = len(words)
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        if request.get('stream'):
+            include_usage = (request.get('stream_options') or {}).get('include_usage')
+            return self._send_stream(request, words, usage if include_usage else None)
+
+        if self.mock.tokens_per_second:
+            time.sleep(len(words) / self.mock.tokens_per_second)
+        message = {'role': "assistant", 'content': " ".join(words)}
+        response = dict()
+        response['id'] = f"chatcmpl-mock-{self.mock.request_count}"
+        response['object'] = "chat.completion"
+        response['model'] = request.get('model')
+        response['choices'] = [{'index': 0, 'message': message, 'finish_reason': "stop"}]
+        response['usage'] = usage
+        self._send_json(200, response)
+
+    def _send_json(self, status, obj, headers={}):
+        data = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header('Content-Type', "application/json")
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    #   Streamed responses have no length, so the connection is closed
+    #   at the end to mark the end of the response
+    def _send_stream(self, request, words, usage):
+        self.send_response(200)
+        self.send_header('Content-Type', "text/event-stream")
+        self.send_header('Connection', "close")
+        self.end_headers()
+        self.close_connection = True
+        delay = 1.0 / self.mock.tokens_per_second if self.mock.tokens_per_second else 0
+
+        def send_event(obj):
+            self.wfile.write(b"data: " + json.dumps(obj).encode("utf-8") + b"\n\n")
+            self.wfile.flush()
+
+        chunk = {'object': "chat.completion.chunk", 'model': request.get('model')}
+        send_event(dict(chunk, choices=[{'index': 0, 'delta': {'role': "assistant"}}]))
+        for i, word in enumerate(words):
+            if delay:
+                time.sleep(delay)
+            text = word if i == 0 else " " + word
+            send_event(dict(chunk, choices=[{'index': 0, 'delta': {'content': text}}]))
+        send_event(dict(chunk, choices=[{'index': 0, 'delta': {}, 'finish_reason': "stop"}]))
+        if usage:
+            send_event(dict(chunk, choices=[], usage=usage))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the chat completions service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY,
+                        help="seconds before the response starts")
+    parser.add_argument("--tokens-per-second", type=float, default=DEFAULT_TOKENS_PER_SECOND,
+                        help="how fast the response is produced, 0 for all at once")
+    parser.add_argument("--completion-tokens", type=int, default=DEFAULT_COMPLETION_TOKENS)
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="share of requests that fail, from 0 to 1")
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--retry-after", type=float, default=None)
+    args = parser.parse_args()
+
+    server = MockChatServer(args.host, args.port, args.latency, args.tokens_per_second,
+                            args.completion_tokens, args.error_rate, args.error_status,
+                            args.retry_after)
+    print(f"Mock chat service listening on {server.url}{OAI_SERVICE_ENDPOINT}", file=sys.stderr)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+#   FILE: prompt_builder.py
+#   CREATION DATE: October, 2026
+#
+#   Builds the release sections of a system prompt, remembering the work.
+#
+#   create_prompt_data_str() used to rebuild the text block of every movie
+#   with repeated += on every call, and the whole prompt template was
+#   formatted again for every new chat context. A PromptBuilder remembers the
+#   rendered block of each movie, keyed by the movie fields it uses, so when
+#   the release list changes only the new or changed movies are rendered.
+#   Each section is put together with a single join, and rendered sections
+#   and formatted prompts are remembered too, so creating another chat
+#   context for the same release list costs almost nothing.
+#
+
+import threading
+from collections import OrderedDict
+
+#   CONSTANTS
+#
+DEFAULT_MAX_BLOCKS = 8192
+DEFAULT_MAX_PROMPTS = 64
+
+
+#
+#   A small least-recently-used dictionary, safe to share between threads
+class _LRU(object):
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+#
+#   A PromptBuilder renders movies into the sections of a prompt.
+#
+#   render_block(movie) returns the text block for one movie, and only uses
+#   the fields named in key_fields. section_of(movie) returns the name of
+#   the section the movie goes in (all movies go in the first section when
+#   it is None). Blocks in a section are joined with separator, and lead is
+#   put in front of a section that has any blocks.
+class PromptBuilder(object):
+    def __init__(self, render_block, key_fields, sections=("movie_data_str",), section_of=None,
+                 separator="\n", lead="", max_blocks=DEFAULT_MAX_BLOCKS,
+                 max_prompts=DEFAULT_MAX_PROMPTS):
+        self.render_block = render_block
+        self.key_fields = tuple(key_fields)
+        self.sections = tuple(sections)
+        self.section_of = section_of
+        self.separator = separator
+        self.lead = lead
+        self._blocks = _LRU(max_blocks)
+        self._rendered = _LRU(max_prompts)
+        self._prompts = _LRU(max_prompts)
+        self.blocks_rendered = 0
+
+    def block_key(self, movie):
+        return tuple(movie.get(field) for field in self.key_fields)
+
+    #
+    #   The (section, block) pair for one movie, rendered only once
+    def movie_block(self, movie):
+        key = self.block_key(movie)
+        entry = self._blocks.get(key)
+        if entry is None:
+            section = self.section_of(movie) if self.section_of else self.sections[0]
+            entry = (section, self.render_block(movie))
+            self._blocks.put(key, entry)
+            self.blocks_rendered += 1
+        return entry
+
+    #
+    #   A dictionary of section name to section text for a list of movies.
+    #   The same list gives back the very same strings, which keeps looking
+    #   up the formatted prompt cheap.
+    def render_sections(self, movie_list=[]):
+        list_key = tuple(self.block_key(movie) for movie in movie_list)
+        rendered = self._rendered.get(list_key)
+        if rendered is not None:
+            return rendered
+        blocks = dict((section, []) for section in self.sections)
+        for movie in movie_list:
+            section, block = self.movie_block(movie)
+            blocks[section].append(block)
+        rendered = dict()
+        for section, section_blocks in blocks.items():
+            rendered[section] = (self.lead + self.separator.join(section_blocks)) if section_blocks else ""
+        self._rendered.put(list_key, rendered)
+        return rendered
+
+    #
+    #   template.format(**sections), remembered for the same template and sections
+    def format_prompt(self, template, **sections):
+        key = (template, tuple(sorted(sections.items())))
+        prompt = self._prompts.get(key)
+        if prompt is None:
+            prompt = template.format(**sections)
+            self._prompts.put(key, prompt)
+        return prompt
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+#
+#   FILE: release_cache.py
+#   CREATION DATE: October, 2026
+#
+#   An on-disk cache for movie release lists.
+#
+#   Collecting the release list from The Numbers is the slowest part of
+#   starting a prototype, and the list only changes about once a day. The
+#   cache keeps each list in a small JSON file keyed by the collector name
+#   and the date. Files are written atomically (see atomic_file.py), so
+#   several processes can share the same cache folder safely.
+#
+#   When a list is older than the TTL it can still be used for a while
+#   (stale-while-revalidate): the old list is returned right away and a
+#   fresh one is collected in the background for the next process.
+#
+
+import os, sys, json, time, re, datetime, threading
+
+from common.atomic_file import write_json_atomic
+
+#   CONSTANTS
+#
+#   The cache folder can be moved with the RECOMMENDER_CACHE_DIR variable
+DEFAULT_CACHE_DIR = os.environ.get("RECOMMENDER_CACHE_DIR") or \
+    os.path.join(os.path.expanduser("~"), ".cache", "hcde598_recommender", "releases")
+#
+#   A list is fresh for one day. After that it may still be returned for
+#   up to a week while a fresh list is being collected.
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_STALE = 7 * 24 * 60 * 60
+
+_UNSAFE_NAME_CHARS = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+#
+#   A ReleaseCache wraps a function that collects a release list
+class ReleaseCache(object):
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL, max_stale=DEFAULT_MAX_STALE):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_stale = max_stale
+        #   Keys that are being collected in the background right now
+        self._revalidating = set()
+        self._lock = threading.Lock()
+
+    #
+    #   Return the release list for the collector name and date. The fetch
+    #   function is only called when there is no usable list in the cache.
+    def get(self, name, fetch, date_str=None, stale_while_revalidate=True):
+        date_str = date_str or datetime.date.today().isoformat()
+        now = time.time()
+        entry = self._read(self._path(name, date_str))
+        if entry and now - entry['fetched_at'] < self.ttl:
+            return entry['movies']
+
+        if stale_while_revalidate:
+            #   An expired list for today, or the newest list from an
+            #   earlier day, is good enough while a new one is collected
+            stale = entry or self._newest_entry(name)
+            if stale and now - stale['fetched_at'] < self.ttl + self.max_stale:
+                self._revalidate(name, fetch, date_str)
+                return stale['movies']
+
+        return self._refresh(name, fetch, date_str)
+
+    #
+    #   Remove cached lists. With no name every list is removed, with no
+    #   date every list for that name is removed. Returns how many were removed.
+    def invalidate(self, name=None, date_str=None):
+        removed = 0
+        for path in self._entry_paths(name):
+            if date_str and not path.endswith(f"--{date_str}.json"):
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def _refresh(self, name, fetch, date_str):
+        movies = list(fetch())
+        entry = dict()
+        entry['name'] = name
+        entry['date'] = date_str
+        entry['fetched_at'] = time.time()
+        entry['movies'] = movies
+        write_json_atomic(self._path(name, date_str), entry)
+        return movies
+
+    def _revalidate(self, name, fetch, date_str):
+        key = (name, date_str)
+        with self._lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+
+        def worker():
+            try:
+                self._refresh(name, fetch, date_str)
+            except Exception as err:
+                print(f"Could not refresh the release list for {name}: {err}", file=sys.stderr)
+            finally:
+                with self._lock:
+                    self._revalidating.discard(key)
+
+        #   A daemon thread does not keep the program from exiting. If the
+        #   program exits first the cache file is simply not replaced.
+        threading.Thread(target=worker, name=f"revalidate-{name}", daemon=True).start()
+
+    def _path(self, name, date_str):
+        safe_name = _UNSAFE_NAME_CHARS.sub("_", name)
+        return os.path.join(self.cache_dir, f"{safe_name}--{date_str}.json")
+
+    def _entry_paths(self, name=None):
+        try:
+            file_names = os.listdir(self.cache_dir)
+        except FileNotFoundError:
+            return []
+        prefix = _UNSAFE_NAME_CHARS.sub("_", name) + "--" if name else ""
+        return [os.path.join(self.cache_dir, file_name) for file_name in file_names
+                if file_name.startswith(prefix) and file_name.endswith(".json")]
+
+    def _newest_entry(self, name):
+        newest = None
+        for path in self._entry_paths(name):
+            entry = self._read(path)
+            if entry and (newest is None or entry['fetched_at'] > newest['fetched_at']):
+                newest = entry
+        return newest
+
+    def _read(self, path):
+        try:
+            with open(path, "r", encoding="utf-8") as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            #   A missing or damaged file is just a cache miss
+            return None
+
+
+#
+#   Running this file removes cached release lists, for example
+#       python -m common.release_cache MovieNumbers-p2.v1
+def main():
+    name = sys.argv[1] if len(sys.argv) > 1 else None
+    removed = ReleaseCache().invalidate(name)
+    print(f"Removed {removed} cached release list(s).")
+
+if __name__ == '__main__':
+    main()
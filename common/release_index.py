@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+#
+#   FILE: release_index.py
+#   CREATION DATE: October, 2026
+#
+#   A small offline search index over a release list.
+#
+#   get_recent_releases(cutoff=7) used to pick seven movies at random, so the
+#   system prompt often left out the movies the user was asking about, and
+#   putting the whole list in the prompt makes every request much bigger. A
+#   ReleaseIndex scores every release against the user's question with BM25
+#   (a standard ranking formula for keyword search) over the title, notes and
+#   release type, so only the few most relevant releases go in the prompt.
+#
+#   Scoring uses NumPy when it is installed, and plain Python otherwise.
+#   NumPy is slow to import, so it is only imported when the first index is
+#   built.
+#
+
+import re, math
+
+#   CONSTANTS
+#
+#   The usual BM25 settings: K1 limits how much repeating a word helps,
+#   B sets how much long documents are penalized
+BM25_K1 = 1.5
+BM25_B = 0.75
+#
+#   The fields of a release that are searched, and how much each counts.
+#   A word in the title counts twice as much as a word in the notes.
+DEFAULT_FIELDS = {'title': 2, 'notes': 1, 'release_type': 1}
+#
+#   Common words that say nothing about which movie is wanted
+STOP_WORDS = frozenset("""a an and are as at be but by can do for from have i if in is it
+    me movie movies my of on or please recommend see should so some something that the
+    there this to want was watch what which with would you""".split())
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+_numpy = None
+
+
+#
+#   The numpy module, or None when it is not installed
+def load_numpy():
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+        _numpy = numpy
+    return _numpy or None
+
+
+def tokenize(text=""):
+    return [word for word in _WORD_PATTERN.findall(text.lower()) if word not in STOP_WORDS]
+
+
+#
+#   A ReleaseIndex is built once from a release list, and can then rank
+#   the list for any number of questions
+class ReleaseIndex(object):
+    def __init__(self, movie_list=[], fields=DEFAULT_FIELDS, k1=BM25_K1, b=BM25_B):
+        self.movies = list(movie_list)
+        self.fields = dict(fields)
+        numpy = load_numpy()
+
+        #   Count the words of every release, weighted by field
+        doc_terms = list()
+        for movie in self.movies:
+            counts = dict()
+            for field, weight in self.fields.items():
+                for word in tokenize(str(movie.get(field) or "")):
+                    counts[word] = counts.get(word, 0) + weight
+            doc_terms.append(counts)
+        doc_lengths = [sum(counts.values()) for counts in doc_terms]
+        average_length = (sum(doc_lengths) / len(doc_lengths)) if doc_lengths else 0.0
+
+        #   For every word, the releases that have it and its BM25 weight in
+        #   each of them. A question is then scored by adding up the weights
+        #   of its words, without looking at releases that don't have them.
+        postings = dict()
+        for doc, counts in enumerate(doc_terms):
+            for word, count in counts.items():
+                postings.setdefault(word, []).append((doc, count))
+        doc_count = len(self.movies)
+        self.postings = dict()
+        for word, entries in postings.items():
+            idf = math.log(1 + (doc_count - len(entries) + 0.5) / (len(entries) + 0.5))
+            docs = list()
+            weights = list()
+            for doc, count in entries:
+                norm = k1 * (1 - b + b * doc_lengths[doc] / average_length) if average_length else k1
+                docs.append(doc)
+                weights.append(idf * count * (k1 + 1) / (count + norm))
+            if numpy is not None:
+                self.postings[word] = (numpy.array(docs, dtype=numpy.int32),
+                                       numpy.array(weights, dtype=numpy.float32))
+            else:
+                self.postings[word] = (docs, weights)
+
+    def __len__(self):
+        return len(self.movies)
+
+    #
+    #   The BM25 score of every release for the question
+    def scores(self, query=""):
+        numpy = load_numpy()
+        words = [word for word in tokenize(query) if word in self.postings]
+        if numpy is not None:
+            scores = numpy.zeros(len(self.movies), dtype=numpy.float32)
+            for word in words:
+                docs, weights = self.postings[word]
+                scores[docs] += weights
+            return scores
+        scores = [0.0] * len(self.movies)
+        for word in words:
+            docs, weights = self.postings[word]
+            for doc, weight in zip(docs, weights):
+                scores[doc] += weight
+        return scores
+
+    #
+    #   The k releases that best match the question, best first. Releases
+    #   that don't match at all are left out; when fewer than k match, the
+    #   list is topped up from fallback (for example, the releases that
+    #   were in the prompt for the previous question).
+    def top_k(self, query="", k=7, fallback=()):
+        scores = self.scores(query)
+        numpy = load_numpy()
+        if numpy is not None:
+            matched = numpy.flatnonzero(scores > 0)
+            if len(matched) > k:
+                matched = matched[numpy.argpartition(-scores[matched], k - 1)[:k]]
+            best = sorted(matched.tolist(), key=lambda doc: (-scores[doc], doc))
+        else:
+            matched = [doc for doc, score in enumerate(scores) if score > 0]
+            best = sorted(matched, key=lambda doc: (-scores[doc], doc))[:k]
+        selected = [self.movies[doc] for doc in best]
+        for movie in fallback:
+            if len(selected) >= k:
+                break
+            if movie not in selected:
+                selected.append(movie)
+        return selected
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+#
+#   FILE: release_sources.py
+#   CREATION DATE: October, 2026
+#
+#   Merges release lists from several sources into one.
+#
+#   get_recent_releases() used to get its list from a single MovieNumbers
+#   collector. A ReleaseAggregator takes any number of sources - collectors
+#   for other pages or date ranges, or CSV and JSON files exported by hand -
+#   and fetches them all at the same time, each with its own timeout, so
+#   collecting takes as long as the slowest source instead of the sum of
+#   them. A source that fails or runs out of time is left out.
+#
+#   Every record is normalized to the shape the prompt builders expect
+#   (title, notes, opening_date_str and original_date_str), and the same
+#   movie from several sources is merged by looking up a normalized title and
+#   year in a dictionary, instead of comparing every pair of records.
+#
+
+import os, re, sys, csv, json, time, unicodedata
+from concurrent.futures import wait, FIRST_COMPLETED
+
+from common.background import run_in_background
+
+#   CONSTANTS
+#
+DEFAULT_SOURCE_TIMEOUT = 30.0
+#
+#   Other names the fields of a release go by in exported files
+FIELD_ALIASES = {
+    'title': ('title', 'movie_title', 'movie', 'name'),
+    'notes': ('notes', 'release_notes', 'note'),
+    'opening_date_str': ('opening_date_str', 'opening_date', 'release_date', 'date'),
+    'original_date_str': ('original_date_str', 'original_release_date', 'original_date'),
+}
+
+_YEAR = re.compile(r"\b(?:19|20)\d\d\b")
+_TITLE_YEAR = re.compile(r"\s*\(((?:19|20)\d\d)\)\s*$")
+_TITLE_PUNCTUATION = re.compile(r"[^\w\s]+")
+_TITLE_SPACE = re.compile(r"\s+")
+
+
+#
+#   Raised when none of the sources gave a release list
+class ReleaseSourceError(Exception):
+    pass
+
+
+#
+#   A named function that returns a list of release records. A source with
+#   timeout None is always waited for, like the main source of a prototype.
+class ReleaseSource(object):
+    def __init__(self, name, fetch, timeout=DEFAULT_SOURCE_TIMEOUT):
+        self.name = name
+        self.fetch = fetch
+        self.timeout = timeout
+
+#
+#   A source that reads a CSV, JSON or JSON lines export. A JSON file can
+#   hold a list of releases, or an object with a 'movies' list (the format
+#   of the release cache).
+def file_source(path, timeout=DEFAULT_SOURCE_TIMEOUT):
+    def fetch():
+        extension = os.path.splitext(path)[1].lower()
+        with open(path, "r", encoding="utf-8", newline="") as release_file:
+            if extension == ".csv":
+                return list(csv.DictReader(release_file))
+            if extension == ".jsonl":
+                return [json.loads(line) for line in release_file if line.strip()]
+            releases = json.load(release_file)
+        if isinstance(releases, dict):
+            releases = releases.get('movies', [])
+        return releases
+    return ReleaseSource(os.path.basename(path), fetch, timeout)
+
+#
+#   The same source, with its list kept in a ReleaseCache (see
+#   release_cache.py) under the name of the source. Each source is cached on
+#   its own and the lists are merged after the cache, so adding or changing
+#   another source never serves an old merged list.
+def cached_source(source, cache):
+    return ReleaseSource(source.name, lambda: cache.get(source.name, source.fetch), source.timeout)
+
+
+#
+#   A copy of a release record with the field names and values the prompt
+#   builders expect, or None when the record has no title. Other fields
+#   are kept as they are.
+def normalize_release(record):
+    release = dict(record)
+    for field, aliases in FIELD_ALIASES.items():
+        for alias in aliases:
+            if record.get(alias) not in (None, ""):
+                release[field] = str(record[alias]).strip()
+                break
+    if not release.get('title'):
+        return None
+    release.setdefault('notes', "")
+    release.setdefault('opening_date_str', "")
+    return release
+
+#
+#   The key two records of the same movie share: the title in lower case,
+#   without accents or punctuation, and the year the movie first came out.
+#   Different movies can have the same title (Halloween from 1978 and from
+#   2018), so the year is part of the key, and so is a leading "The"
+#   (Batman and The Batman).
+def title_key(release):
+    text = unicodedata.normalize("NFKD", release['title'])
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    #   A trailing "(1978)" is the year, not part of the title
+    title_year = _TITLE_YEAR.search(text)
+    if title_year:
+        text = text[:title_year.start()]
+    text = _TITLE_PUNCTUATION.sub(" ", text.casefold())
+    text = _TITLE_SPACE.sub(" ", text).strip()
+    return text, title_year.group(1) if title_year else release_year(release)
+
+#
+#   The year the movie first came out: the original date of a re-release,
+#   otherwise the opening date. An empty string when neither has a year.
+def release_year(release):
+    for field in ('original_date_str', 'opening_date_str'):
+        match = _YEAR.search(release.get(field) or "")
+        if match:
+            return match.group(0)
+    return ""
+
+#
+#   Merge lists of release records, in order of priority. The first record
+#   of a movie is kept, and fields it is missing are filled in from records
+#   of the same movie in later lists. Records in the same list are never
+#   merged with each other (a source may list a movie twice on purpose), so
+#   one list comes out the same whether or not other lists are merged in.
+def merge_releases(release_lists):
+    merged = list()
+    by_title = dict()
+    for source_number, releases in enumerate(release_lists):
+        for record in releases:
+            release = normalize_release(record)
+            if release is None:
+                continue
+            key = title_key(release)
+            found = by_title.get(key)
+            if found is None:
+                by_title[key] = (source_number, release)
+                merged.append(release)
+                continue
+            kept_source, kept = found
+            if kept_source == source_number:
+                merged.append(release)
+                continue
+            for field in FIELD_ALIASES:
+                if kept.get(field) in (None, "") and release.get(field) not in (None, ""):
+                    kept[field] = release[field]
+    return merged
+
+
+#
+#   A ReleaseAggregator fetches all of its sources at the same time and
+#   merges what they return. Sources earlier in the list win when the same
+#   movie is found in more than one.
+class ReleaseAggregator(object):
+    def __init__(self, sources=[]):
+        self.sources = list(sources)
+        #   For every source: how many releases it gave, how long it took,
+        #   and the error if it failed
+        self.last_report = None
+
+    def collect(self):
+        report = dict((source.name, {'releases': 0, 'seconds': None, 'error': None})
+                      for source in self.sources)
+        results = dict()
+        start = time.monotonic()
+        #   One daemon thread per source. A source that runs out of time is
+        #   not waited for, and its thread is left to finish in the
+        #   background, or stopped when the program exits.
+        futures = dict()
+        for source in self.sources:
+            future = run_in_background(self._fetch, source, name=f"release-source-{source.name}")
+            futures[future] = source
+
+        pending = set(futures)
+        while pending:
+            now = time.monotonic()
+            expired = [future for future in pending if futures[future].timeout is not None
+                       and now - start >= futures[future].timeout]
+            for future in expired:
+                pending.discard(future)
+                future.cancel()
+                report[futures[future].name]['error'] = "timed out"
+            if not pending:
+                break
+            deadlines = [start + futures[future].timeout for future in pending
+                         if futures[future].timeout is not None]
+            timeout = max(0.0, min(deadlines) - now) if deadlines else None
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                source = futures[future]
+                try:
+                    releases, seconds = future.result()
+                except Exception as err:
+                    report[source.name]['error'] = str(err) or type(err).__name__
+                    continue
+                results[source.name] = releases
+                report[source.name]['releases'] = len(releases)
+                report[source.name]['seconds'] = seconds
+
+        for name, entry in report.items():
+            if entry['error']:
+                print(f"Release source {name} was left out: {entry['error']}", file=sys.stderr)
+        self.last_report = report
+        if not results:
+            raise ReleaseSourceError("None of the release sources returned a list")
+        #   Merge in the order of the sources, not the order they finished
+        return merge_releases(results[source.name] for source in self.sources
+                              if source.name in results)
+
+    def _fetch(self, source):
+        start = time.perf_counter()
+        releases = list(source.fetch() or [])
+        return releases, time.perf_counter() - start
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+#
+#   FILE: release_types.py
+#   CREATION DATE: October, 2026
+#
+#   Sorts releases into release types from their notes.
+#
+#   The prototypes used to lowercase and split the notes of every movie and
+#   walk a chain of if/elif substring checks. A ReleaseTypeClassifier is
+#   built from a table of (keyword, release type) pairs. All of the keywords
+#   are compiled into one regular expression, so the notes of a movie are
+#   scanned once no matter how many release types there are. When several
+#   keywords are found, the one earliest in the table wins, just like the
+#   if/elif chain.
+#
+#   The table can be replaced without changing any code: point the
+#   RECOMMENDER_RELEASE_TYPES environment variable at a JSON file with a list
+#   of [keyword, release type] pairs.
+#
+
+import os, re, json
+
+#   CONSTANTS
+#
+#   Keywords are matched anywhere in the notes, ignoring case
+DEFAULT_RELEASE_TYPES = (
+    ("wide", "Wide Release"),
+    ("limited", "Limited Release"),
+    ("imax", "IMAX Release"),
+    ("re-release", "Re-release"),
+    ("festival", "Festival Release"),
+    ("special", "Special Engagement"),
+)
+DEFAULT_RELEASE_TYPE = "General Release"
+RELEASE_TYPES_ENV = "RECOMMENDER_RELEASE_TYPES"
+
+
+#
+#   A ReleaseTypeClassifier gives every movie a release type. With
+#   primary_only only the first part of the notes (up to the first comma)
+#   is used, otherwise all of the notes are searched.
+class ReleaseTypeClassifier(object):
+    def __init__(self, table=DEFAULT_RELEASE_TYPES, default=DEFAULT_RELEASE_TYPE, primary_only=True):
+        self.table = [(keyword.lower(), release_type) for keyword, release_type in table]
+        self.default = default
+        self.primary_only = primary_only
+        #   For every keyword, its place in the table and its release type
+        self._priority = dict()
+        for index, (keyword, release_type) in enumerate(self.table):
+            self._priority.setdefault(keyword, (index, release_type))
+        #   A lookahead finds a keyword at every place in the notes, so a
+        #   keyword inside another one (like "release" in "re-release") is
+        #   found too. Where several keywords start at the same place, the
+        #   one earliest in the table is tried first.
+        keywords = sorted(self._priority, key=lambda keyword: self._priority[keyword][0])
+        self._pattern = re.compile("(?=(" + "|".join(re.escape(keyword) for keyword in keywords) + "))",
+                                   re.IGNORECASE) if keywords else None
+        #   Release calendars repeat the same few notes over and over
+        self._memo = dict()
+
+    #
+    #   Make a classifier from a JSON file with a list of [keyword, release type] pairs
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        with open(path, "r", encoding="utf-8") as table_file:
+            table = json.load(table_file)
+        return cls([tuple(entry) for entry in table], **kwargs)
+
+    #
+    #   The release type for one set of notes
+    def classify_notes(self, notes=""):
+        release_type = self._memo.get(notes)
+        if release_type is not None:
+            return release_type
+        text = notes or ""
+        if self.primary_only:
+            text = text.partition(',')[0]
+        best = None
+        if self._pattern is not None:
+            for match in self._pattern.finditer(text):
+                priority = self._priority[match.group(1).lower()]
+                if best is None or priority[0] < best[0]:
+                    best = priority
+                    if best[0] == 0:
+                        break
+        release_type = best[1] if best else self.default
+        self._memo[notes] = release_type
+        return release_type
+
+    #
+    #   The release types for a whole list of movies, in the same order
+    def classify(self, movie_list=[]):
+        classify_notes = self.classify_notes
+        return [classify_notes(movie.get('notes')) for movie in movie_list]
+
+
+#
+#   The classifier with the default table, or with the table from the
+#   file named by the RECOMMENDER_RELEASE_TYPES environment variable
+def default_classifier(**kwargs):
+    path = os.environ.get(RELEASE_TYPES_ENV)
+    if path:
+        return ReleaseTypeClassifier.from_file(path, **kwargs)
+    return ReleaseTypeClassifier(**kwargs)
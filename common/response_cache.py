@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#
+#   FILE: response_cache.py
+#   CREATION DATE: October, 2026
+#
+#   A cache for chat completion responses.
+#
+#   Many users open with the same first question against the same system
+#   prompt, and each of those is a paid round trip to the service. The cache
+#   key is a hash of everything that decides the response: the model, the
+#   temperature, max_tokens and all of the messages. Responses are kept in
+#   an in-memory LRU (least recently used) tier, and optionally in a folder
+#   on disk that several processes can share.
+#
+#   Only requests with temperature 0 are cached by default. With a higher
+#   temperature the service is expected to give different answers.
+#
+
+import os, json, hashlib, threading
+from collections import OrderedDict
+
+from common.atomic_file import write_bytes_atomic
+from common.chat_message import encode_chat_body
+
+#   CONSTANTS
+#
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_MAX_DISK_ENTRIES = 4096
+#
+#   The temperature the service uses when a request does not set one
+SERVICE_DEFAULT_TEMPERATURE = 1.0
+#
+#   The parts of a chat_context that decide what the response will be
+KEY_FIELDS = ('model', 'temperature', 'max_tokens', 'messages')
+
+
+#
+#   Make a stable key for a chat_context. The same context always gives
+#   the same key, no matter the order its keys were added in. The messages
+#   of a ChatContext are not encoded again (see chat_message.py).
+def cache_key(chat_context):
+    return hashlib.sha256(encode_chat_body(chat_context, KEY_FIELDS)).hexdigest()
+
+
+#
+#   A ResponseCache maps cache keys to response dictionaries
+class ResponseCache(object):
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, cache_dir=None,
+                 max_disk_entries=DEFAULT_MAX_DISK_ENTRIES, cache_nondeterministic=False):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max_disk_entries
+        self.cache_nondeterministic = cache_nondeterministic
+        #   Responses are kept as encoded JSON, so a hit always returns
+        #   a new dictionary that the caller is free to change
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_entries = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    #
+    #   Should the response to this chat_context be cached?
+    def cacheable(self, chat_context):
+        if self.cache_nondeterministic:
+            return True
+        temperature = chat_context.get('temperature')
+        if temperature is None:
+            temperature = SERVICE_DEFAULT_TEMPERATURE
+        return temperature == 0
+
+    #
+    #   Return the cached response for a key, or None on a miss
+    def get(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return json.loads(data)
+        data = self._read_disk(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._remember(key, data)
+        return json.loads(data)
+
+    def put(self, key, resp_dict):
+        data = json.dumps(resp_dict).encode("utf-8")
+        with self._lock:
+            self._remember(key, data)
+        self._write_disk(key, data)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        for path in self._disk_paths():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._disk_entries = None
+
+    def stats(self):
+        stats = dict()
+        stats['hits'] = self.hits
+        stats['disk_hits'] = self.disk_hits
+        stats['misses'] = self.misses
+        stats['entries'] = len(self._memory)
+        return stats
+
+    #   Add to the memory tier, dropping the least recently used
+    #   entries when it is full. The caller holds the lock.
+    def _remember(self, key, data):
+        self._memory[key] = data
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def _disk_paths(self):
+        if not self.cache_dir or not os.path.isdir(self.cache_dir):
+            return []
+        paths = list()
+        for folder in os.listdir(self.cache_dir):
+            folder_path = os.path.join(self.cache_dir, folder)
+            if os.path.isdir(folder_path):
+                paths.extend(os.path.join(folder_path, name)
+                             for name in os.listdir(folder_path) if name.endswith(".json"))
+        return paths
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as cache_file:
+                data = cache_file.read()
+            #   Touch the file so eviction on disk is least recently used too
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def _write_disk(self, key, data):
+        if not self.cache_dir:
+            return
+        write_bytes_atomic(self._disk_path(key), data)
+        if self._disk_entries is None:
+            self._disk_entries = len(self._disk_paths())
+        else:
+            self._disk_entries += 1
+        if self._disk_entries > self.max_disk_entries:
+            self._evict_disk()
+
+    #   Remove the least recently used files until the disk tier is
+    #   back down to nine tenths of its size limit
+    def _evict_disk(self):
+        entries = list()
+        for path in self._disk_paths():
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+        entries.sort()
+        keep = self.max_disk_entries * 9 // 10
+        for mtime, path in entries[:max(0, len(entries) - keep)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._disk_entries = min(len(entries), keep)
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+#
+#   FILE: scheduler.py
+#   CREATION DATE: October, 2026
+#
+#   Retries, backoff and client-side rate limits for chat requests.
+#
+#   The service answers with 429 (too many requests) when a key goes over
+#   its rate limits, and with 5xx when it is having trouble. A failed request
+#   used to crash the chat session. The RequestScheduler wraps the request:
+#
+#   - failed requests that are worth retrying are retried after a jittered
+#     exponential backoff, or after the time the service asks for in its
+#     Retry-After and x-ratelimit-reset-* headers
+#   - two token buckets keep the requests per minute and the (estimated)
+#     tokens per minute under the budgets of the key
+#   - a bounded number of requests can be waiting or in flight at once, so
+#     a burst of requests waits its turn instead of failing
+#
+
+import re, time, random, threading
+
+from common.chat_client import ChatRequestError
+
+#   CONSTANTS
+#
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 30.0
+DEFAULT_MAX_QUEUE = 64
+#
+#   Status codes where trying again later may work. A request that failed
+#   before it got any response (status None) is also retried.
+RETRY_STATUS = (408, 409, 429, 500, 502, 503, 504)
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_SECONDS = {'ms': 0.001, 's': 1.0, 'm': 60.0, 'h': 3600.0}
+
+
+#
+#   Raised when the queue stays full for longer than queue_timeout
+class QueueFullError(Exception):
+    pass
+
+
+#
+#   A token bucket holds up to one minute of budget and refills smoothly.
+#   Callers reserve what they need; if the bucket does not have enough the
+#   caller is told how long to wait, and the reservation still counts. This
+#   keeps callers in the order they arrived.
+class TokenBucket(object):
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    #   Take amount from the bucket and return the seconds to wait
+    def reserve(self, amount):
+        with self._lock:
+            self._refill()
+            self.level -= min(amount, self.capacity)
+            if self.level >= 0:
+                return 0.0
+            return -self.level / self.rate
+
+    #   Correct an earlier reservation, once the real amount is known
+    def adjust(self, amount):
+        with self._lock:
+            self._refill()
+            self.level = min(self.capacity, self.level - amount)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+#
+#   Parse a duration like "1s", "6m0s" or "250ms" into seconds
+def parse_duration(text):
+    if not text:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(text)
+    if not parts:
+        return None
+    return sum(float(value) * _DURATION_SECONDS[unit] for value, unit in parts)
+
+#
+#   How long the service asked us to wait, from the response headers
+def retry_after_seconds(headers):
+    if not headers:
+        return None
+    retry_after = headers.get('Retry-After')
+    if retry_after:
+        seconds = parse_duration(retry_after)
+        if seconds is not None:
+            return seconds
+        try:
+            #   Retry-After can also be an HTTP date. email.utils is only
+            #   imported when it is needed, to keep start up fast.
+            from email.utils import parsedate_to_datetime
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    #   Otherwise wait for whichever limit was used up to reset
+    waits = list()
+    for kind in ("requests", "tokens"):
+        if headers.get(f"x-ratelimit-remaining-{kind}") == "0":
+            seconds = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+            if seconds is not None:
+                waits.append(seconds)
+    return max(waits) if waits else None
+
+
+#
+#   A RequestScheduler runs request functions with retries and rate limits.
+#   One scheduler should be shared by everything that uses the same key.
+class RequestScheduler(object):
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None,
+                 max_retries=DEFAULT_MAX_RETRIES, base_delay=DEFAULT_BASE_DELAY,
+                 max_delay=DEFAULT_MAX_DELAY, max_queue=DEFAULT_MAX_QUEUE,
+                 queue_timeout=None):
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        #   With no queue_timeout a caller waits as long as it takes for
+        #   a place in the queue
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_queue)
+        #   After a 429 every request waits, not just the one that failed
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self.retry_count = 0
+        self.throttle_wait = 0.0
+
+    #
+    #   Call send() and return its result. estimated_tokens is the number
+    #   of tokens the request is expected to use. When the result has a
+    #   'usage' the token budget is corrected with the real number. Retries
+    #   are counted in the optional turn record (see metrics.py).
+    def run(self, send, estimated_tokens=0, turn=None):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise QueueFullError("Too many chat requests are waiting")
+        try:
+            attempt = 0
+            while True:
+                wait = self._budget_wait(estimated_tokens)
+                if wait > 0:
+                    time.sleep(wait)
+                try:
+                    result = send()
+                except ChatRequestError as err:
+                    if not self._should_retry(err, attempt):
+                        raise
+                    time.sleep(self._retry(err, attempt, turn))
+                    attempt += 1
+                    continue
+                self._adjust_budget(result, estimated_tokens)
+                return result
+        finally:
+            self._slots.release()
+
+    #
+    #   The same for a coroutine function send, for example in the
+    #   AsyncChatEngine (see async_engine.py). The waits don't block the event
+    #   loop. The queue limit is not used: the engine has its own limit on
+    #   the requests in flight.
+    async def run_async(self, send, estimated_tokens=0, turn=None):
+        import asyncio
+        attempt = 0
+        while True:
+            wait = self._budget_wait(estimated_tokens)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                result = await send()
+            except ChatRequestError as err:
+                if not self._should_retry(err, attempt):
+                    raise
+                await asyncio.sleep(self._retry(err, attempt, turn))
+                attempt += 1
+                continue
+            self._adjust_budget(result, estimated_tokens)
+            return result
+
+    def _should_retry(self, err, attempt):
+        if attempt >= self.max_retries:
+            return False
+        return err.status is None or err.status in RETRY_STATUS
+
+    #   Full jitter: a random delay up to the exponential backoff, unless
+    #   the service said how long to wait
+    def _retry_delay(self, err, attempt):
+        asked = retry_after_seconds(err.headers)
+        if asked is not None:
+            return min(self.max_delay, asked) + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    #
+    #   Count a retry and return how long to wait before it. After a 429
+    #   every request waits, not just the one that failed.
+    def _retry(self, err, attempt, turn=None):
+        delay = self._retry_delay(err, attempt)
+        with self._lock:
+            if err.status == 429:
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self.retry_count += 1
+        if turn is not None:
+            turn['retries'] += 1
+        return delay
+
+    #
+    #   Correct the token budget with the real usage of a response
+    def _adjust_budget(self, result, estimated_tokens):
+        if self.token_bucket and isinstance(result, dict):
+            used = (result.get('usage') or {}).get('total_tokens')
+            if used is not None:
+                self.token_bucket.adjust(used - estimated_tokens)
+
+    #
+    #   Reserve the budget for one request, and return how long to wait for it
+    def _budget_wait(self, estimated_tokens):
+        wait = 0.0
+        if self.request_bucket:
+            wait = max(wait, self.request_bucket.reserve(1))
+        if self.token_bucket and estimated_tokens:
+            wait = max(wait, self.token_bucket.reserve(estimated_tokens))
+        with self._lock:
+            wait = max(wait, self._paused_until - time.monotonic())
+            if wait > 0:
+                self.throttle_wait += wait
+        return wait
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+#
+#   FILE: session_store.py
+#   CREATION DATE: October, 2026
+#
+#   An append-only store for chat sessions.
+#
+#   The chat history only lived in the chat_context dictionary, so it was lost
+#   when main() returned. Writing the whole dictionary out after every turn
+#   would cost more and more as the session grows. The SessionStore instead
+#   appends each new turn to a log for the session, one line of JSON per turn,
+#   and appends the position of that line to a small index file:
+#
+#       {session_id}.jsonl  - the turns, in order
+#       {session_id}.idx    - one fixed-size (offset, length) record per turn
+#
+#   Finding turn i only needs record i of the index, so any turn can be read
+#   without reading the ones before it. When a session is resumed, the log is
+#   opened as a LoggedMessages sequence (memory-mapped when it is large) and
+#   only the recent turns that fit in the context window are decoded.
+#
+#   A session should have one writer at a time. A worker that takes over a
+#   session simply resumes it and keeps appending.
+#
+
+import os, re, sys, json, mmap, uuid, struct, threading
+from collections.abc import Sequence
+
+from common.context_window import TOKENS_PER_MESSAGE, TOKENS_PER_REPLY, estimate_tokens
+from common.chat_message import encode_message
+
+#   CONSTANTS
+#
+#   The session folder can be moved with the RECOMMENDER_SESSION_DIR variable
+DEFAULT_SESSION_DIR = os.environ.get("RECOMMENDER_SESSION_DIR") or \
+    os.path.join(os.path.expanduser("~"), ".cache", "hcde598_recommender", "sessions")
+#
+#   An index record is the offset and the length of one line of the log
+INDEX_RECORD = struct.Struct("<QI")
+#
+#   Logs at least this big are memory-mapped instead of read into memory
+MMAP_THRESHOLD = 1024 * 1024
+
+_UNSAFE_NAME_CHARS = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+#
+#   A new, random session id
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+#
+#   A read-only sequence of the turns in a session log. A turn is only
+#   decoded when it is asked for, and is remembered after that.
+class LoggedMessages(Sequence):
+    def __init__(self, log_path, index_path):
+        with open(index_path, "rb") as index_file:
+            index = index_file.read()
+        self._log_file = open(log_path, "rb")
+        log_size = os.fstat(self._log_file.fileno()).st_size
+        if log_size >= MMAP_THRESHOLD:
+            self._data = mmap.mmap(self._log_file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._data = self._log_file.read()
+        #   Only whole records that point inside the log count. Anything else
+        #   was left by a writer that stopped part way through a turn.
+        count = len(index) // INDEX_RECORD.size
+        while count > 0:
+            offset, length = INDEX_RECORD.unpack_from(index, (count - 1) * INDEX_RECORD.size)
+            if offset + length <= log_size:
+                break
+            count -= 1
+        self._index = index[:count * INDEX_RECORD.size]
+        self._decoded = dict()
+
+    def __len__(self):
+        return len(self._index) // INDEX_RECORD.size
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("turn index out of range")
+        message = self._decoded.get(position)
+        if message is None:
+            offset, length = INDEX_RECORD.unpack_from(self._index, position * INDEX_RECORD.size)
+            message = json.loads(bytes(self._data[offset:offset + length]))
+            self._decoded[position] = message
+        return message
+
+    #
+    #   The most recent turns whose estimated size fits in token_budget,
+    #   oldest first. Turns before the first one that fits are never decoded.
+    def tail(self, token_budget=None):
+        if token_budget is None:
+            return self[:]
+        first = len(self)
+        used = 0
+        while first > 0:
+            cost = TOKENS_PER_MESSAGE + estimate_tokens(self[first - 1].get('content') or "")
+            if used + cost > token_budget:
+                break
+            used += cost
+            first -= 1
+        #   Don't start with an assistant turn without the user turn it answered
+        while first < len(self) and self[first].get('role') == "assistant":
+            first += 1
+        return self[first:]
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._log_file.close()
+
+
+#
+#   A SessionStore keeps the logs of many sessions in one folder
+class SessionStore(object):
+    def __init__(self, store_dir=DEFAULT_SESSION_DIR, durable=False):
+        self.store_dir = store_dir
+        #   With durable every turn is flushed all the way to the disk
+        #   (fsync), which is safer but slower
+        self.durable = durable
+        #   Open (log, index) files for the sessions being written
+        self._writers = dict()
+        self._lock = threading.Lock()
+
+    def exists(self, session_id):
+        return os.path.exists(self._index_path(session_id))
+
+    #
+    #   Append one turn to the log of a session
+    def append(self, session_id, message):
+        line = encode_message(message)
+        with self._lock:
+            log_file, index_file = self._writer(session_id)
+            offset = log_file.tell()
+            log_file.write(line + b"\n")
+            log_file.flush()
+            index_file.write(INDEX_RECORD.pack(offset, len(line)))
+            index_file.flush()
+            if self.durable:
+                os.fsync(log_file.fileno())
+                os.fsync(index_file.fileno())
+
+    def extend(self, session_id, messages):
+        for message in messages:
+            self.append(session_id, message)
+
+    #
+    #   All of the turns of a session, as a LoggedMessages sequence
+    def messages(self, session_id):
+        return LoggedMessages(self._log_path(session_id), self._index_path(session_id))
+
+    #
+    #   Put the logged turns of a session back into a new chat_context,
+    #   after its system turn. Only the most recent turns that fit in the
+    #   context_window (if one is given) are read. Returns how many turns
+    #   were restored.
+    def restore(self, session_id, chat_context, context_window=None):
+        if not self.exists(session_id):
+            return 0
+        budget = None
+        if context_window is not None:
+            used = TOKENS_PER_REPLY + sum(TOKENS_PER_MESSAGE + estimate_tokens(m.get('content') or "")
+                                          for m in chat_context['messages'])
+            budget = context_window.token_budget - (chat_context.get('max_tokens') or 0) - used
+        logged = self.messages(session_id)
+        try:
+            turns = logged.tail(budget)
+        finally:
+            logged.close()
+        chat_context['messages'].extend(turns)
+        return len(turns)
+
+    #
+    #   Close the files of one session, or of every session
+    def close(self, session_id=None):
+        with self._lock:
+            session_ids = [session_id] if session_id else list(self._writers)
+            for sid in session_ids:
+                files = self._writers.pop(sid, None)
+                if files:
+                    for open_file in files:
+                        open_file.close()
+
+    def _writer(self, session_id):
+        files = self._writers.get(session_id)
+        if files is None:
+            os.makedirs(self.store_dir, exist_ok=True)
+            index_file = open(self._index_path(session_id), "ab")
+            #   Drop a record that was only partly written
+            index_size = index_file.tell()
+            if index_size % INDEX_RECORD.size:
+                index_file.truncate(index_size - index_size % INDEX_RECORD.size)
+                index_file.seek(0, os.SEEK_END)
+            log_file = open(self._log_path(session_id), "ab")
+            files = (log_file, index_file)
+            self._writers[session_id] = files
+        return files
+
+    def _log_path(self, session_id):
+        return os.path.join(self.store_dir, _UNSAFE_NAME_CHARS.sub("_", session_id) + ".jsonl")
+
+    def _index_path(self, session_id):
+        return os.path.join(self.store_dir, _UNSAFE_NAME_CHARS.sub("_", session_id) + ".idx")
+
+
+#
+#   Running this file prints the turns of a session, for example
+#       python -m common.session_store 3f2a9c...
+def main():
+    if len(sys.argv) < 2:
+        print("usage: python -m common.session_store SESSION_ID")
+        return
+    store = SessionStore()
+    if not store.exists(sys.argv[1]):
+        print(f"No session {sys.argv[1]} in {store.store_dir}")
+        return
+    logged = store.messages(sys.argv[1])
+    for message in logged:
+        print(f"{message.get('role')} > {message.get('content')}\n")
+    logged.close()
+
+if __name__ == '__main__':
+    main()
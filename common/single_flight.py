@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+#
+#   FILE: single_flight.py
+#   CREATION DATE: October, 2026
+#
+#   Shares one call between callers that ask for the same thing at once.
+#
+#   When a release drops, many sessions send the same opening question
+#   against the same system prompt at the same moment. The response cache
+#   (see response_cache.py) does not help with those, because none of them
+#   has finished yet. With a SingleFlight the first caller for a key (the
+#   leader) makes the call, and every caller that arrives with the same key
+#   while it is running (a follower) waits for the leader's result instead
+#   of making its own call. A failure is passed on to every follower too.
+#
+#   Each follower waits at most its own timeout, so one slow call can't
+#   hold a caller longer than it is willing to wait. A follower that gives
+#   up does not stop the call for the others.
+#
+#   AsyncSingleFlight does the same for coroutines in one event loop. asyncio
+#   is only imported when it is used, so the threaded prototypes don't load it.
+#
+
+import copy, hashlib, threading
+
+from common.chat_message import encode_chat_body
+
+#   CONSTANTS
+#
+#   Seconds a follower waits for the leader when no timeout is given
+DEFAULT_WAIT_TIMEOUT = 90.0
+
+
+#
+#   Raised in a follower that gave up waiting for the leader
+class FlightTimeout(Exception):
+    pass
+
+
+#
+#   The key of a request: a hash of its whole body. Unlike the cache key,
+#   every setting counts, so only requests that would be sent exactly the
+#   same are shared.
+def flight_key(chat_context):
+    return hashlib.sha256(encode_chat_body(chat_context)).hexdigest()
+
+
+#
+#   One running call and the result its followers are waiting for
+class _Flight(object):
+    __slots__ = ('done', 'result', 'error', 'followers')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+#
+#   A SingleFlight can be shared by any number of threads
+class SingleFlight(object):
+    def __init__(self, timeout=DEFAULT_WAIT_TIMEOUT):
+        self.timeout = timeout
+        self._flights = dict()
+        self._lock = threading.Lock()
+        #   How many calls were made, and how many callers shared one
+        self.calls = 0
+        self.shared = 0
+
+    #
+    #   Return fn(), or the result of the same call already running for
+    #   key. Returns (result, shared), where shared is True for a follower.
+    #   A follower gets its own copy of the result, so callers can change
+    #   what they get back.
+    def do(self, key, fn, timeout=None):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = _Flight()
+                self._flights[key] = flight
+                self.calls += 1
+                leader = True
+            else:
+                flight.followers += 1
+                self.shared += 1
+                leader = False
+
+        if leader:
+            try:
+                result = fn()
+            except BaseException as err:
+                flight.error = err
+                raise
+            finally:
+                #   Later callers start a new call
+                with self._lock:
+                    del self._flights[key]
+                #   The followers get a copy of their own, so the leader is
+                #   free to change the result it returns
+                if flight.followers and flight.error is None:
+                    flight.result = copy.deepcopy(result)
+                flight.done.set()
+            return result, False
+
+        if not flight.done.wait(self.timeout if timeout is None else timeout):
+            raise FlightTimeout("Gave up waiting for the same request to finish")
+        if flight.error is not None:
+            raise _follower_error(flight.error)
+        return copy.deepcopy(flight.result), True
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+
+#
+#   The same for coroutines. It must only be used from one event loop.
+class AsyncSingleFlight(object):
+    def __init__(self, timeout=DEFAULT_WAIT_TIMEOUT):
+        self.timeout = timeout
+        self._flights = dict()
+        self.calls = 0
+        self.shared = 0
+
+    #
+    #   Await make_call(), or the same call already running for key
+    async def do(self, key, make_call, timeout=None):
+        import asyncio
+        task = self._flights.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(make_call())
+            self._flights[key] = task
+            task.add_done_callback(lambda done, key=key: self._flights.pop(key, None))
+            #   The leader is not limited by the wait timeout. Cancelling
+            #   the leader cancels the call for the followers too.
+            return await task, False
+
+        self.shared += 1
+        try:
+            #   shield() keeps a follower that gives up from cancelling the call
+            result = await asyncio.wait_for(asyncio.shield(task),
+                                            self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            raise FlightTimeout("Gave up waiting for the same request to finish")
+        except asyncio.CancelledError:
+            if task.cancelled():
+                raise FlightTimeout("The same request was cancelled")
+            raise
+        except Exception as err:
+            raise _follower_error(err)
+        return copy.deepcopy(result), True
+
+    def in_flight(self):
+        return len(self._flights)
+
+
+#
+#   The error a follower raises for the leader's error. Raising the same
+#   exception object in several threads would mix up its traceback, so a
+#   follower raises a copy that points back to the original.
+def _follower_error(err):
+    try:
+        follower_err = copy.copy(err)
+    except Exception:
+        follower_err = RuntimeError(str(err))
+    follower_err.__cause__ = err
+    follower_err.__traceback__ = None
+    return follower_err